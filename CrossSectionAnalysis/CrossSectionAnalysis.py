@@ -1,10 +1,15 @@
 import os
 import unittest
 import logging
+import time
+import collections
+import concurrent.futures
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import numpy
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 from slicer.util import VTKObservationMixin
+from CrossSectionAnalysisLib import PathGeometry, VolumeSampling, CrossSectionCache, Instrumentation, BranchGraph, PathDataCache
 
 #
 # CrossSectionAnalysis
@@ -56,6 +61,23 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     self.widgetMarkupPointRemovedObserver = None
     # Remove observers on previous path when currrent node has changed
     self.previousPath = None
+    # Observed to move the slice to the path position nearest to the crosshair
+    self.crosshairNode = None
+    self.crosshairObserver = None
+    # Slider positions not applied yet. Only the latest one is applied when the timers expire.
+    self.pendingSlicePosition = None
+    self.pendingLabelPosition = None
+    self.sliceUpdateTimer = None
+    self.labelUpdateTimer = None
+    # Fly-through : position follows the wall clock from a start distance and time
+    self.playbackTimer = None
+    self.playbackStartDistance = 0.0
+    self.playbackStartTime = 0.0
+    # Frames computed ahead of the current playback position
+    self.playbackDistances = numpy.zeros(0)
+    self.playbackFrames = None
+    # Times of the frames shown during the last second
+    self.playbackFrameTimes = collections.deque()
 
   def setup(self):
     """
@@ -80,35 +102,77 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     
     # Hide diameter labels. Concern only VMTK centerline models.
     self.showDiameterLabels(False)
+    # Selections of the branch combo box items
+    self.branchChoices = []
+    self.showBranchSelector(False)
     
     self.ui.moreCollapsibleButton.collapsed = True
+    self.ui.flyThroughCollapsibleButton.collapsed = True
     self.ui.advancedCollapsibleButton.collapsed = True
     self.ui.roiCollapsibleButton.collapsed = True
+    self.ui.straightenCollapsibleButton.collapsed = True
+    self.ui.statisticsCollapsibleButton.collapsed = True
+    self.ui.instrumentationCollapsibleButton.collapsed = True
     slicer.modules.reformat.widgetRepresentation().setEditedNode(slicer.util.getNode("vtkMRMLSliceNodeRed"))
     self.resetSliderWidget()
+    self.logic.setPathDataCacheEnabled(self.ui.pathDataCacheCheckBox.checked)
+
+    # Slider scrubbing : the slice is moved at most once per frame, labels are refreshed less often
+    self.sliceUpdateTimer = qt.QTimer()
+    self.sliceUpdateTimer.setSingleShot(True)
+    self.sliceUpdateTimer.setInterval(16)
+    self.sliceUpdateTimer.connect("timeout()", self.applyPendingSlicePosition)
+    self.labelUpdateTimer = qt.QTimer()
+    self.labelUpdateTimer.setSingleShot(True)
+    self.labelUpdateTimer.setInterval(100)
+    self.labelUpdateTimer.connect("timeout()", self.applyPendingLabelPosition)
+    self.playbackTimer = qt.QTimer()
+    self.playbackTimer.connect("timeout()", self.onPlaybackTick)
 
     # Connections
     self.ui.inputSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelectNode)
-    self.ui.positionIndexSliderWidget.connect("valueChanged(double)", self.logic.process)
-
-    # Feedback on module UI
-    self.ui.positionIndexSliderWidget.connect("valueChanged(double)", self.showCurrentPositionData)
+    self.ui.branchComboBox.connect("currentIndexChanged(int)", self.onBranchChanged)
+    # Reslicing and feedback on module UI
+    self.ui.positionIndexSliderWidget.connect("valueChanged(double)", self.onPositionChanged)
     self.ui.redRadioButton.connect("clicked()", self.onRadioRed)
     self.ui.greenRadioButton.connect("clicked()", self.onRadioGreen)
     self.ui.yellowRadioButton.connect("clicked()", self.onRadioYellow)
     self.ui.hideCheckBox.connect("clicked()", self.onHidePath)
+    self.ui.distanceModeCheckBox.connect("toggled(bool)", self.onDistanceModeToggled)
+    self.ui.followCrosshairCheckBox.connect("toggled(bool)", self.onFollowCrosshairToggled)
+    self.ui.longitudinalViewsCheckBox.connect("toggled(bool)", self.onLongitudinalViewsToggled)
+    self.ui.pathDataCacheCheckBox.connect("toggled(bool)", self.logic.setPathDataCacheEnabled)
     self.ui.createMarkupsCurvePushButton.connect("clicked()", self.createMarksupCurve)
     self.ui.roiSelector.connect("nodeAddedByUser(vtkMRMLNode*)", self.onCreateROI)
     self.ui.roiSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onCurrentROIChanged)
     self.ui.hideROICheckBox.connect("clicked()", self.onHideROI)
+    self.ui.createTileROIsPushButton.connect("clicked()", self.onCreateTileROIs)
     self.ui.relativeOriginSpinBox.connect("valueChanged(double)", self.logic.onRelativeOriginChanged)
     self.ui.relativeOriginSpinBox.connect("valueChanged(double)", self.showRelativeDistance)
+    self.ui.playPushButton.connect("toggled(bool)", self.onPlayToggled)
+    self.ui.straightenPushButton.connect("clicked()", self.onStraighten)
+    self.ui.statisticsPushButton.connect("clicked()", self.onComputeStatistics)
+    self.ui.liveStatisticsCheckBox.connect("toggled(bool)", self.onLiveStatisticsToggled)
+    self.ui.instrumentationCheckBox.connect("toggled(bool)", Instrumentation.setEnabled)
+    self.ui.refreshInstrumentationPushButton.connect("clicked()", self.showInstrumentationReport)
+    self.ui.resetInstrumentationPushButton.connect("clicked()", self.onResetInstrumentation)
+    self.ui.logInstrumentationPushButton.connect("clicked()", self.onLogInstrumentation)
+    self.ui.saveInstrumentationPushButton.connect("clicked()", self.onSaveInstrumentation)
+    self.ui.speedSpinBox.connect("valueChanged(double)", self.onPlaybackParametersChanged)
+    self.ui.frameRateSpinBox.connect("valueChanged(int)", self.onPlaybackParametersChanged)
     
   def cleanup(self):
+    self.playbackTimer.stop()
+    self.onFollowCrosshairToggled(False)
+    self.logic.setCrossSectionCacheEnabled(False)
+    self.sliceUpdateTimer.stop()
+    self.labelUpdateTimer.stop()
     self.logic.removeMarkupObservers()
     self.removeWidgetMarkupObservers(self.ui.inputSelector.currentNode())
       
+  @Instrumentation.instrumented()
   def onSelectNode(self):
+    self.ui.playPushButton.setChecked(False)
     self.removeWidgetMarkupObservers(self.previousPath)
     inputPath = self.ui.inputSelector.currentNode()
     self.logic.selectNode(inputPath)
@@ -129,22 +193,210 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
         self.showDiameterLabels(True)
     else:
         self.showDiameterLabels(False)
+    self.setBranchComboBox()
     
+  # List the branches and routes of a centerline model, the logic's default selected
+  def setBranchComboBox(self):
+    self.branchChoices = self.logic.getBranchChoices()
+    wasBlocked = self.ui.branchComboBox.blockSignals(True)
+    self.ui.branchComboBox.clear()
+    for text, selection in self.branchChoices:
+        self.ui.branchComboBox.addItem(text)
+    selections = [selection for text, selection in self.branchChoices]
+    if self.logic.branchSelection in selections:
+        self.ui.branchComboBox.setCurrentIndex(selections.index(self.logic.branchSelection))
+    self.ui.branchComboBox.blockSignals(wasBlocked)
+    self.showBranchSelector(len(self.branchChoices) > 1)
+
+  # Follow another branch from its start
+  @Instrumentation.instrumented()
+  def onBranchChanged(self, index):
+    if index < 0 or index >= len(self.branchChoices):
+        return
+    self.ui.playPushButton.setChecked(False)
+    self.logic.selectBranch(self.branchChoices[index][1])
+    self.setSliderWidget()
+    self.ui.positionIndexSliderWidget.setValue(0)
+    self.logic.process(0)
+    self.showCurrentPositionData(0)
+
+  # Coalesce slider changes. The first change is applied at once, the following ones
+  # only when the timer expires, and then only the latest value.
+  @Instrumentation.instrumented()
+  def onPositionChanged(self, value):
+    # Playback ticks move the slider with its signals blocked : this change comes from the user, who takes over
+    if self.playbackTimer.isActive():
+        self.ui.playPushButton.setChecked(False)
+    self.logic.cancelCrossSectionPrefetch()
+    self.pendingSlicePosition = value
+    if not self.sliceUpdateTimer.isActive():
+        self.applyPendingSlicePosition()
+    self.pendingLabelPosition = value
+    if not self.labelUpdateTimer.isActive():
+        self.applyPendingLabelPosition()
+
+  @Instrumentation.instrumented()
+  def applyPendingSlicePosition(self):
+    if self.pendingSlicePosition is None:
+        # The slider rests : sample around its position ahead
+        self.prefetchCurrentCrossSections()
+        return
+    value = self.pendingSlicePosition
+    self.pendingSlicePosition = None
+    self.logic.process(value)
+    self.sliceUpdateTimer.start()
+
+  @Instrumentation.instrumented()
+  def applyPendingLabelPosition(self):
+    if self.pendingLabelPosition is None:
+        return
+    value = self.pendingLabelPosition
+    self.pendingLabelPosition = None
+    self.showCurrentPositionData(value)
+    self.labelUpdateTimer.start()
+
+  @Instrumentation.instrumented()
+  def onPlayToggled(self, checked):
+    if checked:
+        self.startPlayback()
+    else:
+        self.stopPlayback()
+
+  # Start from the current position, or from start of path if at its end
+  def startPlayback(self):
+    if self.logic.pathArray.size == 0 or self.logic.pathLength() == 0.0:
+        self.ui.playPushButton.setChecked(False)
+        return
+    startDistance = self.logic.positionDistance(self.ui.positionIndexSliderWidget.value)
+    if startDistance >= self.logic.pathLength():
+        startDistance = 0.0
+    self.playbackStartDistance = startDistance
+    self.playbackStartTime = time.perf_counter()
+    self.playbackFrameTimes.clear()
+    self.prefetchPlaybackFrames(startDistance)
+    self.playbackTimer.setInterval(int(1000 / self.ui.frameRateSpinBox.value))
+    self.playbackTimer.start()
+    self.ui.playPushButton.text = "Pause"
+
+  def stopPlayback(self):
+    self.playbackTimer.stop()
+    self.playbackFrames = None
+    self.ui.playPushButton.text = "Play"
+    self.ui.achievedFrameRateLabel.setText("")
+
+  # Restart the clock from the current position with the new speed or frame rate
+  @Instrumentation.instrumented()
+  def onPlaybackParametersChanged(self):
+    if not self.playbackTimer.isActive():
+        return
+    now = time.perf_counter()
+    self.playbackStartDistance = self.playbackDistance(now)
+    self.playbackStartTime = now
+    self.prefetchPlaybackFrames(self.playbackStartDistance)
+    self.playbackTimer.setInterval(int(1000 / self.ui.frameRateSpinBox.value))
+
+  def playbackDistance(self, now):
+    distance = self.playbackStartDistance + self.ui.speedSpinBox.value * (now - self.playbackStartTime)
+    return min(distance, self.logic.pathLength())
+
+  # Frames for the next second at the target frame rate, interpolated in one batch
+  def prefetchPlaybackFrames(self, distance):
+    frameRate = self.ui.frameRateSpinBox.value
+    step = self.ui.speedSpinBox.value / frameRate
+    self.playbackDistances = distance + numpy.arange(frameRate + 1) * step
+    self.playbackFrames = self.logic.framesAtDistances(self.playbackDistances)
+
+  # The position is computed from the elapsed time. If a frame took too long,
+  # the next one jumps ahead : frames are dropped instead of accumulating lag.
+  @Instrumentation.instrumented()
+  def onPlaybackTick(self):
+    now = time.perf_counter()
+    distance = self.playbackDistance(now)
+    if distance < self.playbackDistances[0] or distance > self.playbackDistances[-1]:
+        self.prefetchPlaybackFrames(distance)
+    step = self.playbackDistances[1] - self.playbackDistances[0]
+    frameIndex = min(int(round((distance - self.playbackDistances[0]) / step)), self.playbackDistances.size - 1)
+    origins, normals, axes = self.playbackFrames
+    self.logic.setSliceFrame(origins[frameIndex], normals[frameIndex], axes[frameIndex])
+    value = self.logic.positionFromDistance(distance)
+    self.logic.lastValue = value
+    # Follow on the slider without reslicing again, labels are throttled
+    sliderWidget = self.ui.positionIndexSliderWidget
+    wasBlocked = sliderWidget.blockSignals(True)
+    sliderWidget.setValue(value)
+    sliderWidget.blockSignals(wasBlocked)
+    self.pendingLabelPosition = value
+    if not self.labelUpdateTimer.isActive():
+        self.applyPendingLabelPosition()
+    # Achieved frame rate over the last second
+    self.playbackFrameTimes.append(now)
+    while now - self.playbackFrameTimes[0] > 1.0:
+        self.playbackFrameTimes.popleft()
+    elapsed = now - self.playbackFrameTimes[0]
+    if elapsed > 0.0:
+        self.ui.achievedFrameRateLabel.setText(str(round((len(self.playbackFrameTimes) - 1) / elapsed, 1)) + " fps")
+    if distance >= self.logic.pathLength():
+        self.ui.playPushButton.setChecked(False)
+
+  @Instrumentation.instrumented()
   def onRadioRed(self):
     self.logic.selectView("vtkMRMLSliceNodeRed")
     
+  @Instrumentation.instrumented()
   def onRadioGreen(self):
     self.logic.selectView("vtkMRMLSliceNodeGreen")
     
+  @Instrumentation.instrumented()
   def onRadioYellow(self):
     self.logic.selectView("vtkMRMLSliceNodeYellow")
     
+  @Instrumentation.instrumented()
   def onHidePath(self):
     path = self.ui.inputSelector.currentNode()
     if path is None:
         return
     path.SetDisplayVisibility(not self.ui.hideCheckBox.checked)
     
+  # Slider value is either a point index or a distance in mm
+  @Instrumentation.instrumented()
+  def onDistanceModeToggled(self, checked):
+    self.logic.setDistanceMode(checked)
+    self.setSliderWidget()
+    self.ui.positionIndexSliderWidget.setValue(0)
+    self.ui.relativeOriginSpinBox.setValue(0)
+    self.logic.process(0)
+    self.showCurrentPositionData(0)
+    
+  # The two other views show longitudinal planes at the current position
+  @Instrumentation.instrumented()
+  def onLongitudinalViewsToggled(self, checked):
+    self.logic.setLongitudinalViewsEnabled(checked)
+    self.logic.process(self.ui.positionIndexSliderWidget.value)
+
+  # Observe the crosshair, moved with Shift + mouse move in any view
+  def onFollowCrosshairToggled(self, checked):
+    if self.crosshairObserver is not None:
+        self.crosshairNode.RemoveObserver(self.crosshairObserver)
+        self.crosshairObserver = None
+        self.crosshairNode = None
+    if not checked:
+        return
+    self.crosshairNode = slicer.mrmlScene.GetFirstNodeByClass("vtkMRMLCrosshairNode")
+    if self.crosshairNode is not None:
+        self.crosshairObserver = self.crosshairNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onCrosshairModified)
+
+  # Snap the slider to the path position nearest to the crosshair.
+  # The slider then moves the slice through the usual coalesced updates.
+  @Instrumentation.instrumented()
+  def onCrosshairModified(self, caller, event):
+    if self.logic.pathArray.size == 0:
+        return
+    crosshairRAS = [0.0, 0.0, 0.0]
+    caller.GetCrosshairRAS(crosshairRAS)
+    position, offset = self.logic.positionNearestToRAS(crosshairRAS)
+    if position is not None and position != self.ui.positionIndexSliderWidget.value:
+        self.ui.positionIndexSliderWidget.setValue(position)
+
   def resetSliderWidget(self):
     sliderWidget = self.ui.positionIndexSliderWidget
     sliderWidget.setDisabled(True)
@@ -165,9 +417,16 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     sliderWidget.setDisabled(False)
     sliderWidget.minimum = 0
     sliderWidget.maximum = 0
-    # if control points are deleted one by one
-    if self.logic.pathArray.size > 1:
-        sliderWidget.maximum = (self.logic.pathArray.size / 3) - 1 - 1
+    if self.logic.distanceMode:
+        sliderWidget.decimals = 1
+        sliderWidget.singleStep = self.logic.distanceStep
+        sliderWidget.maximum = self.logic.pathLength()
+    else:
+        sliderWidget.decimals = 0
+        sliderWidget.singleStep = 1
+        # if control points are deleted one by one
+        if self.logic.pathArray.size > 1:
+            sliderWidget.maximum = (self.logic.pathArray.size / 3) - 1
     # relativeOriginSpinBox must have same value span as the sliderWidget spin box
     self.setRelativeOriginWidget()
     
@@ -182,21 +441,26 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
   def setRelativeOriginWidget(self):
     sliderWidget = self.ui.positionIndexSliderWidget
     relativeOriginWidget = self.ui.relativeOriginSpinBox
+    relativeOriginWidget.decimals = sliderWidget.decimals
+    relativeOriginWidget.singleStep = sliderWidget.singleStep
     relativeOriginWidget.minimum = sliderWidget.minimum
     relativeOriginWidget.maximum = sliderWidget.maximum
     
   # logic.onWidgetMarkupPointAdded gets called first
+  @Instrumentation.instrumented()
   def onWidgetMarkupPointAdded(self, caller, event):
     self.setSliderWidget()
     self.ui.positionIndexSliderWidget.setValue(0)
     self.showCurrentPositionData(0)
 
+  @Instrumentation.instrumented()
   def onWidgetMarkupPointRemoved(self, caller, event):
     self.setSliderWidget()
     self.ui.positionIndexSliderWidget.setValue(0)
     self.showCurrentPositionData(0)
   
   # Position on path is not reset here
+  @Instrumentation.instrumented()
   def onWidgetMarkupPointEndInteraction(self, caller, event):
     self.showCurrentPositionData(self.logic.lastValue)
 
@@ -213,6 +477,7 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
         inputPath.RemoveObserver(self.widgetMarkupPointRemovedObserver)
         inputPath.RemoveObserver(self.widgetMarkupPointObserver)
         
+  @Instrumentation.instrumented()
   def showCurrentPositionData(self, value):
     # Get coordinates on path
     currentPoint = self.logic.currentPosition(value);
@@ -233,7 +498,7 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     # VMTK centerline radius
     inputPath = self.ui.inputSelector.currentNode()
     if inputPath is not None and inputPath.GetClassName() == "vtkMRMLModelNode" and self.logic.vmtkCenterlineRadii.size > 0:
-        diameter = str(round(self.logic.vmtkCenterlineRadii[int(value)] * 2, 1))
+        diameter = str(round(self.logic.currentRadius(value) * 2, 1))
         self.ui.diameterLabel.setText(diameter + " mm")
     # Orientation
     orient = self.logic.getSliceOrientation()
@@ -241,10 +506,43 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     orientation += "A " + str(round(orient[1], 1)) + "°, "
     orientation += "S " + str(round(orient[2], 1)) + "°"
     self.ui.orientationLabel.setText(orientation)
+    # Lumen area from the cached cross-section
+    if self.ui.liveStatisticsCheckBox.checked:
+        self.showCurrentLumenArea(value)
+
+  @Instrumentation.instrumented()
+  def onLiveStatisticsToggled(self, checked):
+    self.logic.setCrossSectionCacheEnabled(checked)
+    self.ui.currentLumenAreaLabel.setText("")
+    self.ui.cacheStatisticsLabel.setText("")
+    if checked:
+        self.showCurrentLumenArea(self.ui.positionIndexSliderWidget.value)
 
+  @Instrumentation.instrumented()
+  def showCurrentLumenArea(self, value):
+    inputVolume = self.ui.statisticsInputSelector.currentNode()
+    if inputVolume is None or self.logic.pathArray.size == 0:
+        self.ui.currentLumenAreaLabel.setText("")
+        return
+    # No prefetch while the slider is scrubbed : it is done when the slider rests
+    lumenArea = self.logic.getCurrentLumenArea(inputVolume, value,
+        self.ui.statisticsRadiusSpinBox.value, self.ui.lumenThresholdSpinBox.value,
+        not self.sliceUpdateTimer.isActive())
+    self.ui.currentLumenAreaLabel.setText(str(round(lumenArea, 1)) + " mm²")
+    cacheStatistics = self.logic.crossSectionCache.statistics()
+    self.ui.cacheStatisticsLabel.setText(str(cacheStatistics["hits"]) + " hits, " + str(cacheStatistics["misses"]) + " misses")
+
+  def prefetchCurrentCrossSections(self):
+    inputVolume = self.ui.statisticsInputSelector.currentNode()
+    if not self.ui.liveStatisticsCheckBox.checked or inputVolume is None or self.logic.pathArray.size == 0:
+        return
+    self.logic.prefetchCrossSections(inputVolume, self.ui.positionIndexSliderWidget.value,
+        2.0 * self.ui.statisticsRadiusSpinBox.value)
+
+  @Instrumentation.instrumented()
   def showRelativeDistance(self):
-    pointIndex = int(self.ui.positionIndexSliderWidget.value)
-    relativeDistance = str(round(self.logic.calculateRelativeDistance(pointIndex), 1))
+    value = self.ui.positionIndexSliderWidget.value
+    relativeDistance = str(round(self.logic.calculateRelativeDistance(value), 1))
     self.ui.distanceLabel.setText(relativeDistance + " mm")
     
   # True : for VMTK centerline models only
@@ -252,7 +550,13 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     self.ui.diameterLabelIndicator.setVisible(show)
     self.ui.diameterLabel.setVisible(show)
 
+  # True : for VMTK centerline models with branches only
+  def showBranchSelector(self, show):
+    self.ui.branchLabel.setVisible(show)
+    self.ui.branchComboBox.setVisible(show)
+
   # Created with the default name
+  @Instrumentation.instrumented()
   def createMarksupCurve(self):
     self.ui.inputSelector.setCurrentNode(None)
     slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsCurveNode")
@@ -270,14 +574,14 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     else:
         markupsWidget.setEditedNode(None)
         
+  @Instrumentation.instrumented()
   def onCreateROI(self):
     inputPath = self.ui.inputSelector.currentNode()
     if inputPath is None:
         slicer.mrmlScene.RemoveNode(self.ui.roiSelector.currentNode())
         return;
-    bounds = numpy.zeros(6)
-    inputPath.GetRASBounds(bounds)
-    box = vtk.vtkBoundingBox(bounds)
+    # Bounds of the path as processed, kept up to date on edits : the selected branch of a centerline model
+    box = vtk.vtkBoundingBox(self.logic.pathBounds)
     center = [0.0, 0.0, 0.0]
     box.GetCenter(center)
     roi = self.ui.roiSelector.currentNode()
@@ -285,6 +589,73 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     roi.SetXYZ(center)
     roi.SetRadiusXYZ(box.GetLength(0) / 2, box.GetLength(1) / 2, box.GetLength(2) / 2)
     
+  # Replace the tile ROIs of the path
+  @Instrumentation.instrumented()
+  def onCreateTileROIs(self):
+    inputPath = self.ui.inputSelector.currentNode()
+    if inputPath is None or self.logic.pathArray.size == 0:
+        slicer.util.errorDisplay("Select a path.")
+        return
+    self.logic.removeTileROIs()
+    self.logic.createTileROIs(self.ui.tileRadiusSpinBox.value, self.ui.tileLengthSpinBox.value,
+        self.ui.tileOverlapSpinBox.value, "ROI " + inputPath.GetName() + " tile")
+
+  @Instrumentation.instrumented()
+  def onStraighten(self):
+    inputVolume = self.ui.straightenInputSelector.currentNode()
+    outputVolume = self.ui.straightenOutputSelector.currentNode()
+    if inputVolume is None or outputVolume is None or self.logic.pathArray.size == 0:
+        slicer.util.errorDisplay("Select a path, an input volume and an output volume.")
+        return
+    qt.QApplication.setOverrideCursor(qt.Qt.WaitCursor)
+    try:
+        self.logic.createStraightenedVolume(inputVolume, outputVolume,
+            self.ui.sliceSpacingSpinBox.value, self.ui.fieldOfViewSpinBox.value)
+    except Exception as e:
+        slicer.util.errorDisplay("Failed to create the straightened volume: " + str(e))
+        import traceback
+        traceback.print_exc()
+    finally:
+        qt.QApplication.restoreOverrideCursor()
+
+  @Instrumentation.instrumented()
+  def onComputeStatistics(self):
+    inputVolume = self.ui.statisticsInputSelector.currentNode()
+    tableNode = self.ui.statisticsTableSelector.currentNode()
+    if inputVolume is None or tableNode is None or self.logic.pathArray.size == 0:
+        slicer.util.errorDisplay("Select a path, an input volume and an output table.")
+        return
+    qt.QApplication.setOverrideCursor(qt.Qt.WaitCursor)
+    try:
+        self.logic.computeCrossSectionStatistics(inputVolume, tableNode, self.ui.statisticsSpacingSpinBox.value,
+            self.ui.statisticsRadiusSpinBox.value, self.ui.lumenThresholdSpinBox.value)
+        self.logic.showStatisticsPlot(tableNode)
+    except Exception as e:
+        slicer.util.errorDisplay("Failed to compute statistics: " + str(e))
+        import traceback
+        traceback.print_exc()
+    finally:
+        qt.QApplication.restoreOverrideCursor()
+
+  # Handler timings, for bug reports
+  def showInstrumentationReport(self):
+    self.ui.instrumentationTextEdit.setPlainText(Instrumentation.formatReport())
+
+  def onResetInstrumentation(self):
+    Instrumentation.reset()
+    self.showInstrumentationReport()
+
+  def onLogInstrumentation(self):
+    logging.info("CrossSectionAnalysis handler timings:\n" + Instrumentation.formatReport())
+
+  def onSaveInstrumentation(self):
+    fileName = qt.QFileDialog.getSaveFileName(None, "Save handler timings", "CrossSectionAnalysisTimings.json",
+        "JSON (*.json);;Text (*.txt)")
+    if not fileName:
+        return
+    Instrumentation.saveReport(fileName)
+
+  @Instrumentation.instrumented()
   def onCurrentROIChanged(self):
     currentROI = self.ui.roiSelector.currentNode()
     if currentROI is None:
@@ -292,6 +663,7 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
         return
     self.ui.hideROICheckBox.setChecked(not currentROI.GetDisplayVisibility())
     
+  @Instrumentation.instrumented()
   def onHideROI(self):
     roi = self.ui.roiSelector.currentNode()
     if roi is None:
@@ -316,8 +688,16 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     Called when the logic class is instantiated. Can be used for initializing member variables.
     """
     self.inputPath = None
-    self.inputSliceNode = slicer.util.getNode("vtkMRMLSliceNodeRed")
-    self.reformatLogic = slicer.modules.reformat.logic()
+    # None without a layout : the path arrays are still computed, only the view is not moved
+    self.inputSliceNode = slicer.mrmlScene.GetNodeByID("vtkMRMLSliceNodeRed")
+    # Optional longitudinal views, driven with the cross-section from the same frame
+    self.longitudinalViewsEnabled = False
+    self.longitudinalSliceNodes = []
+    # ROI nodes created by createTileROIs, by path node ID
+    self.tileROINodes = {}
+    # Optional persistent cache of distances, bounds and frames, for paths of at least this number of points
+    self.pathDataCache = None
+    self.pathDataCacheMinimumPoints = 1000
     self.pathArray = numpy.zeros(0)
     # Use independent observers to reprocess the slice when a markup curve is modified
     self.markupPointObserver = None
@@ -326,77 +706,500 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     # on markup change, reprocess last point
     self.lastValue = 0
     self.cumDistancesArray = numpy.zeros(0)
+    # RAS bounds of the path
+    self.pathBounds = numpy.zeros(6)
+    # Slice frame at each point : normal (smoothed tangent) and parallel transported in-plane axis.
+    # It is rebuilt only if the path or its modified time change.
+    self.frameNormals = numpy.zeros((0, 3))
+    self.frameAxes = numpy.zeros((0, 3))
+    self.frameTablePath = None
+    self.frameTableMTime = 0
+    # Number of points on each side of a point to smooth the tangent
+    self.tangentSmoothingHalfWidth = 2
+    # Control points of a markups curve, and the index of their curve point.
+    # An edit then recomputes only the curve points it reaches.
+    self.controlPointsArray = numpy.zeros((0, 3))
+    self.controlPointCurveIndices = numpy.zeros(0, dtype = int)
+    # Curve points moving less than this (mm) are considered unchanged by an edit
+    self.incrementalUpdateTolerance = 1e-3
     self.vmtkCenterlineRadii = numpy.zeros(0)
+    # Read-only views on the arrays of a centerline model, the VTK arrays they share, and the model's modified time
+    self.modelPointsView = numpy.zeros((0, 3))
+    self.modelRadiiView = numpy.zeros(0)
+    self.modelViewSources = None
+    self.modelViewMTime = 0
+    # Branch topology of a centerline model, rebuilt only if the model or its mesh change
+    self.branchGraph = None
+    self.branchGraphPath = None
+    self.branchGraphMTime = 0
+    # Followed part of a centerline model : ("all", None), ("branch", branch index) or ("route", end node)
+    self.branchSelection = ("all", None)
+    self.frameTableBranchSelection = None
+    # Point locator over the path array, rebuilt with the frame table and after edits
+    self.pathLocator = None
+    self.pathLocatorPoints = None
     self.relativeOrigin = 0
+    # Positions are point indices, or distances in mm from start of path
+    self.distanceMode = False
+    # Optional cache of sampled cross-section images, and number of positions sampled ahead and behind
+    self.crossSectionCache = None
+    self.prefetchCount = 4
+    # Slider step in mm mode : cross-sections are prefetched at this spacing
+    self.distanceStep = 0.1
     # self.backgroundVolumeNode = slicer.app.layoutManager().sliceWidget(self.inputSliceNode.GetName()).sliceLogic().GetBackgroundLayer().GetVolumeNode()
   
   # Real origin is start of path. Relative origin is any point.
+  @Instrumentation.instrumented()
   def onRelativeOriginChanged(self, value):
     self.relativeOrigin = value
     
-  # Distance of the relative origin from start of path
-  def getRelativeOriginDistance(self):
+  # Positions given to process() and currentPosition() are in mm if True, else point indices
+  def setDistanceMode(self, enabled):
+    self.distanceMode = enabled
+    self.relativeOrigin = 0
+    self.lastValue = 0
+
+  # Total length of the path
+  def pathLength(self):
     if self.cumDistancesArray.size == 0:
         return 0.0
-    return self.cumDistancesArray[int(self.relativeOrigin)]
+    return self.cumDistancesArray[-1]
+
+  # Distance from start of path of a position in the current mode
+  def positionDistance(self, value):
+    if self.cumDistancesArray.size == 0:
+        return 0.0
+    if self.distanceMode:
+        return min(max(value, 0.0), self.pathLength())
+    return self.cumDistancesArray[int(value)]
+
+  # Position in the current mode of a distance from start of path
+  def positionFromDistance(self, distance):
+    if self.distanceMode:
+        return distance
+    pointIndex, fraction = PathGeometry.locateDistance(self.cumDistancesArray, distance)
+    return int(pointIndex) + int(round(float(fraction)))
+
+  # Distance of the relative origin from start of path
+  def getRelativeOriginDistance(self):
+    return self.positionDistance(self.relativeOrigin)
 
   # Calculate distance from point and the relative origin
-  def calculateRelativeDistance(self, pointIndex):
+  @Instrumentation.instrumented()
+  def calculateRelativeDistance(self, value):
     if self.cumDistancesArray.size == 0:
         return 0.0
     # Distance of the relative origin from start of path
     relativeOriginDistance = self.getRelativeOriginDistance()
     # Distance of point from start of path
-    distanceFromStart = self.cumDistancesArray[pointIndex]
+    distanceFromStart = self.positionDistance(value)
     return distanceFromStart - relativeOriginDistance
 
   def resetSliceNodeOrientationToDefault(self):
-    if self.inputPath is None:
+    if self.inputPath is None or self.inputSliceNode is None:
         return
-    slicer.app.layoutManager().sliceWidget(self.inputSliceNode.GetName()).mrmlSliceNode().SetOrientationToDefault()
+    self.inputSliceNode.SetOrientationToDefault()
 
-  # Get the path's array of points
-  def fillPathArray(self):
-    if self.inputPath is None or self.inputSliceNode is None:
+  # Latest modification of the path's geometry
+  def pathModifiedTime(self):
+    if self.inputPath is None:
+        return 0
+    modifiedTime = self.inputPath.GetMTime()
+    if self.inputPath.GetClassName() == "vtkMRMLModelNode":
+        if self.inputPath.GetMesh() is not None:
+            modifiedTime = max(modifiedTime, self.inputPath.GetMesh().GetMTime())
+    else:
+        curvePoints = self.inputPath.GetCurvePointsWorld()
+        if curvePoints is not None:
+            modifiedTime = max(modifiedTime, curvePoints.GetMTime())
+    return modifiedTime
+
+  # The frame table is up to date with the path's geometry
+  def isFrameTableCurrent(self):
+    return (self.inputPath is not None
+        and self.inputPath is self.frameTablePath
+        and self.pathModifiedTime() == self.frameTableMTime
+        and self.branchSelection == self.frameTableBranchSelection)
+
+  # Get the path's array of points.
+  # The persistent cache is used when a path or a branch is selected only (cached = True) :
+  # every edit of a markups curve would write a file of a geometry that is not seen again.
+  @Instrumentation.instrumented()
+  def fillPathArray(self, cached = False):
+    if self.inputPath is None:
         self.pathArray = numpy.zeros(0)
-        self.cumDistancesArray = numpy.zeros(0)
         self.vmtkCenterlineRadii = numpy.zeros(0)
+        self.cumulateDistances()
+        self.buildFrameTable()
+        return
+    # Nothing to recompute if the geometry has not changed
+    if self.isFrameTableCurrent():
         return
     if self.inputPath.GetClassName() == "vtkMRMLMarkupsCurveNode" or self.inputPath.GetClassName() == "vtkMRMLMarkupsClosedCurveNode":
         self.vmtkCenterlineRadii = numpy.zeros(0)
         # All control points have been deleted except one
         if self.inputPath.GetNumberOfControlPoints() < 2:
             self.pathArray = numpy.zeros(0)
-            self.cumDistancesArray = numpy.zeros(0)
+            self.storeControlPoints()
+            self.cumulateDistances()
+            self.buildFrameTable()
             return
-        self.pathArray = slicer.util.arrayFromMarkupsCurvePoints(self.inputPath)
+        with Instrumentation.section("copy curve points"):
+            self.copyCurvePoints()
+        self.storeControlPoints()
     # For VMTK centerline models, get the array of radii
     if self.inputPath.GetClassName() == "vtkMRMLModelNode":
-        self.pathArray = slicer.util.arrayFromModelPoints(self.inputPath)
-        self.vmtkCenterlineRadii = slicer.util.arrayFromModelPointData(self.inputPath, 'Radius')
-    # Compute the distances for each point once
+        with Instrumentation.section("model array views"):
+            self.pathArray, self.vmtkCenterlineRadii = self.getModelArrayViews()
+        # Points of the selected branch or route only, in order
+        pointIds = self.getBranchSelectionPointIds()
+        if pointIds is not None:
+            self.pathArray = self.pathArray[pointIds]
+            self.vmtkCenterlineRadii = self.vmtkCenterlineRadii[pointIds] if self.vmtkCenterlineRadii.size > 0 else self.vmtkCenterlineRadii
+    # Reuse the distances, bounds and frames of the same geometry, computed in a previous session
+    if cached and self.loadPathData():
+        return
+    # Compute the distances and bounds for all points once
     self.cumulateDistances()
+    # Compute the slice frames for all points once
+    self.buildFrameTable()
+    if cached:
+        self.savePathData()
+
+  # Persistent cache of path data, in Slicer's cache directory by default
+  def setPathDataCacheEnabled(self, enabled, directory = None, maximumSize = 512 * 1024 * 1024):
+    if not enabled:
+        self.pathDataCache = None
+        return
+    if directory is None:
+        directory = os.path.join(slicer.app.cachePath, "CrossSectionAnalysis")
+    self.pathDataCache = PathDataCache.PathDataCache(directory, maximumSize)
+
+  # Identifies the path geometry and the parameters of the computation
+  def pathDataKey(self):
+    return self.pathDataCache.key(self.pathArray, {"tangentSmoothingHalfWidth" : self.tangentSmoothingHalfWidth})
+
+  # Short paths are computed faster than read
+  def usesPathDataCache(self):
+    return self.pathDataCache is not None and self.pathArray.shape[0] >= self.pathDataCacheMinimumPoints
+
+  # True if distances, bounds and frames were read from the cache
+  @Instrumentation.instrumented()
+  def loadPathData(self):
+    if not self.usesPathDataCache():
+        return False
+    arrays = self.pathDataCache.load(self.pathDataKey())
+    if arrays is None or arrays["cumDistances"].shape[0] != self.pathArray.shape[0]:
+        return False
+    self.cumDistancesArray = arrays["cumDistances"]
+    self.pathBounds = arrays["pathBounds"]
+    self.frameNormals = arrays["frameNormals"]
+    self.frameAxes = arrays["frameAxes"]
+    self.setFrameTableCurrent()
+    return True
+
+  @Instrumentation.instrumented()
+  def savePathData(self):
+    if not self.usesPathDataCache():
+        return
+    self.pathDataCache.save(self.pathDataKey(), {
+        "cumDistances" : self.cumDistancesArray,
+        "pathBounds" : self.pathBounds,
+        "frameNormals" : self.frameNormals,
+        "frameAxes" : self.frameAxes,
+        })
+
+  # Read-only views on the points and the 'Radius' array of the model, without copy.
+  # They are refreshed only if the mesh is modified ; the VTK arrays are referenced to keep their memory alive.
+  def getModelArrayViews(self):
+    polyData = self.inputPath.GetPolyData()
+    if polyData is None or polyData.GetPoints() is None:
+        return numpy.zeros((0, 3)), numpy.zeros(0)
+    pointsData = polyData.GetPoints().GetData()
+    radiusData = polyData.GetPointData().GetArray('Radius')
+    viewSources = (pointsData, radiusData)
+    if (self.modelViewSources is None or self.modelViewSources[0] is not pointsData or self.modelViewSources[1] is not radiusData
+        or self.modelViewMTime != self.pathModifiedTime()):
+        self.modelPointsView = vtk_to_numpy(pointsData)
+        self.modelPointsView.setflags(write = False)
+        if radiusData is None:
+            self.modelRadiiView = numpy.zeros(0)
+        else:
+            self.modelRadiiView = vtk_to_numpy(radiusData)
+            self.modelRadiiView.setflags(write = False)
+        self.modelViewSources = viewSources
+        self.modelViewMTime = self.pathModifiedTime()
+    return self.modelPointsView, self.modelRadiiView
+
+  # Curve points of a markups curve, copied into the path array in place if the number of points is unchanged.
+  # The path array stays owned by the logic : an incremental update compares it with the new curve and patches it.
+  def copyCurvePoints(self):
+    curvePoints = self.inputPath.GetCurvePointsWorld()
+    if curvePoints is None:
+        self.pathArray = numpy.zeros((0, 3))
+        return
+    curveArray = vtk_to_numpy(curvePoints.GetData())
+    if self.pathArray.shape == curveArray.shape and self.pathArray.flags.writeable and self.pathArray.dtype == numpy.float64:
+        numpy.copyto(self.pathArray, curveArray)
+    else:
+        self.pathArray = numpy.array(curveArray, dtype = numpy.float64)
+
+  # Remember the control points of a markups curve, to find what an edit has changed
+  def storeControlPoints(self, curveIndices = None):
+    if self.inputPath is None or self.inputPath.GetClassName() == "vtkMRMLModelNode":
+        self.controlPointsArray = numpy.zeros((0, 3))
+        self.controlPointCurveIndices = numpy.zeros(0, dtype = int)
+        return
+    self.controlPointsArray = slicer.util.arrayFromMarkupsControlPoints(self.inputPath)
+    if curveIndices is None:
+        curveIndices = self.getControlPointCurveIndices()
+    self.controlPointCurveIndices = curveIndices
+
+  def getControlPointCurveIndices(self):
+    numberOfControlPoints = self.inputPath.GetNumberOfControlPoints()
+    return numpy.array([self.inputPath.GetCurvePointIndexFromControlPointIndex(i) for i in range(numberOfControlPoints)], dtype = int)
+
+  # Open curves with local interpolation only. A polynomial fit or a surface path moves everything.
+  def canUpdateIncrementally(self):
+    if self.inputPath is None or self.inputPath.GetClassName() != "vtkMRMLMarkupsCurveNode":
+        return False
+    if self.inputPath is not self.frameTablePath or self.pathArray.size == 0:
+        return False
+    if self.controlPointsArray.shape[0] < 2 or self.inputPath.GetNumberOfControlPoints() < 2:
+        return False
+    if self.inputPath.GetCurvePointsWorld() is None:
+        return False
+    return self.inputPath.GetCurveType() not in (slicer.vtkCurveGenerator.CURVE_TYPE_POLYNOMIAL,
+        slicer.vtkCurveGenerator.CURVE_TYPE_SHORTEST_DISTANCE_ON_SURFACE)
+
+  # Update the path arrays after a control point is moved, added or removed.
+  # Only the curve points reached by the edit are read from the curve ; distances, frames
+  # and bounds are patched in place. A spline edit fades out along the curve : the range grows
+  # until the curve points on both sides of it are unchanged.
+  @Instrumentation.instrumented()
+  def updatePathArray(self):
+    if not self.canUpdateIncrementally():
+        self.fillPathArray()
+        return
+    controlPoints = slicer.util.arrayFromMarkupsControlPoints(self.inputPath)
+    start, oldEnd, newEnd = PathGeometry.changedRange(self.controlPointsArray, controlPoints)
+    if start is None:
+        self.frameTableMTime = self.pathModifiedTime()
+        return
+    # No copy : a view on the curve points
+    curveArray = vtk_to_numpy(self.inputPath.GetCurvePointsWorld().GetData())
+    curveIndices = self.getControlPointCurveIndices()
+    spliceRange = PathGeometry.curveSpliceRange(self.pathArray, curveArray, self.controlPointCurveIndices, curveIndices,
+        start, newEnd, self.incrementalUpdateTolerance)
+    if spliceRange is None:
+        self.fillPathArray()
+        return
+    curveStart, oldStop, newStop = spliceRange
+    (self.pathArray, self.cumDistancesArray, self.frameNormals, self.frameAxes,
+        self.pathBounds) = PathGeometry.splicePath(self.pathArray, self.cumDistancesArray,
+        self.frameNormals, self.frameAxes, self.pathBounds, curveStart, oldStop,
+        curveArray[curveStart:newStop], self.tangentSmoothingHalfWidth)
+    self.storeControlPoints(curveIndices)
+    self.buildPathLocator()
+    self.frameTableMTime = self.pathModifiedTime()
+
+  # Slice frame at each point, for the current path array
+  @Instrumentation.instrumented()
+  def buildFrameTable(self):
+    if self.pathArray.size == 0:
+        self.frameNormals = numpy.zeros((0, 3))
+        self.frameAxes = numpy.zeros((0, 3))
+    else:
+        self.frameNormals, self.frameAxes = PathGeometry.computeFrames(self.pathArray, self.tangentSmoothingHalfWidth)
+    self.setFrameTableCurrent()
+
+  # The frame table now matches the path's geometry and the selected branch
+  def setFrameTableCurrent(self):
+    self.frameTablePath = self.inputPath
+    self.frameTableMTime = self.pathModifiedTime()
+    self.frameTableBranchSelection = self.branchSelection
+    self.buildPathLocator()
+
+  # Index of the path points in VTK's static point locator : a bucket sort, and sub-millisecond queries
+  # even on centerlines of hundreds of thousands of points. The VTK points share the path array's memory.
+  @Instrumentation.instrumented()
+  def buildPathLocator(self):
+    if self.pathArray.size == 0:
+        self.pathLocator = None
+        self.pathLocatorPoints = None
+        return
+    self.pathLocatorPoints = numpy.ascontiguousarray(self.pathArray)
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(self.pathLocatorPoints))
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(points)
+    self.pathLocator = vtk.vtkStaticPointLocator()
+    self.pathLocator.SetDataSet(polyData)
+    self.pathLocator.BuildLocator()
+
+  # Position in the current mode nearest to a RAS point, between points in mm mode,
+  # and the distance of the RAS point from the path. (None, inf) without a path.
+  @Instrumentation.instrumented()
+  def positionNearestToRAS(self, rasPoint):
+    if self.pathLocator is None:
+        return None, numpy.inf
+    pointIndex = self.pathLocator.FindClosestPoint(rasPoint[0], rasPoint[1], rasPoint[2])
+    distance, offset = PathGeometry.projectNearPoint(self.pathArray, self.cumDistancesArray, pointIndex, rasPoint)
+    return self.positionFromDistance(distance), offset
+
+  # Branch topology of the selected centerline model, built once per geometry.
+  # Polylines of VMTK centerlines overlap : their coincident points are merged.
+  @Instrumentation.instrumented()
+  def getBranchGraph(self):
+    if self.inputPath is None or self.inputPath.GetClassName() != "vtkMRMLModelNode" or self.inputPath.GetPolyData() is None:
+        return None
+    if self.branchGraph is not None and self.inputPath is self.branchGraphPath and self.pathModifiedTime() == self.branchGraphMTime:
+        return self.branchGraph
+    polyData = self.inputPath.GetPolyData()
+    legacyLines = vtk.vtkIdTypeArray()
+    polyData.GetLines().ExportLegacyFormat(legacyLines)
+    cells = BranchGraph.cellsFromLegacyArray(vtk_to_numpy(legacyLines))
+    if len(cells) == 0:
+        return None
+    self.branchGraph = BranchGraph.BranchGraph(self.getModelArrayViews()[0], cells)
+    self.branchGraphPath = self.inputPath
+    self.branchGraphMTime = self.pathModifiedTime()
+    return self.branchGraph
+
+  # Model point ids of the selected branch or route, or None for all points in model order
+  def getBranchSelectionPointIds(self):
+    selectionType, selectionValue = self.branchSelection
+    if selectionType == "all":
+        return None
+    branchGraph = self.getBranchGraph()
+    if branchGraph is None:
+        return None
+    if selectionType == "branch" and selectionValue < branchGraph.numberOfBranches:
+        return branchGraph.branchPointIds[selectionValue]
+    if selectionType == "route":
+        pointIds = branchGraph.routePointIds(selectionValue)
+        if pointIds.size > 0:
+            return pointIds
+    return None
+
+  # Selectable parts of the centerline model : (text, selection), routes first
+  def getBranchChoices(self):
+    choices = [("All points", ("all", None))]
+    branchGraph = self.getBranchGraph()
+    if branchGraph is None or branchGraph.numberOfBranches < 2:
+        return choices
+    for endIndex, endNode in enumerate(branchGraph.endNodes()):
+        routeLength = branchGraph.routeLength(endNode)
+        if routeLength is not None:
+            choices.append(("Inlet to end " + str(endIndex + 1) + " (" + str(round(routeLength, 1)) + " mm)", ("route", endNode)))
+    for branchIndex in range(branchGraph.numberOfBranches):
+        choices.append(("Branch " + str(branchIndex + 1) + " (" + str(round(branchGraph.branchLengths[branchIndex], 1)) + " mm)", ("branch", branchIndex)))
+    return choices
+
+  # Longest route from the inlet if the model has branches, else all points
+  def getDefaultBranchSelection(self):
+    routes = [choice for choice in self.getBranchChoices() if choice[1][0] == "route"]
+    if not routes:
+        return ("all", None)
+    return max(routes, key = lambda choice: self.branchGraph.routeLength(choice[1][1]))[1]
+
+  # Follow another part of the centerline model. The graph is reused, only the path arrays are recomputed.
+  @Instrumentation.instrumented()
+  def selectBranch(self, selection):
+    self.branchSelection = selection
+    self.relativeOrigin = 0
+    self.lastValue = 0
+    self.fillPathArray(cached = True)
 
-  # Move the reformated slice along path, and point it to the next point
+  # Frames at several distances from start of path, interpolated in one batch
+  def framesAtDistances(self, distances):
+    return PathGeometry.interpolateFrames(self.pathArray, self.frameNormals, self.frameAxes, self.cumDistancesArray, distances)
+
+  # Orient the slice with a frame from the table, and the longitudinal slices if enabled.
+  # All changes are batched : each slice node is modified once, and the views are rendered once.
+  @Instrumentation.instrumented()
+  def setSliceFrame(self, origin, normal, axis):
+    sliceNodes = [self.inputSliceNode]
+    matrices = [PathGeometry.frameMatrices(origin, normal, axis)]
+    if self.longitudinalSliceNodes:
+        # Longitudinal planes contain the tangent, shown vertically : their normals are the in-plane axes
+        # of the cross-section, axis and normal x axis.
+        normal = numpy.asarray(normal, dtype = numpy.float64)
+        axis = numpy.asarray(axis, dtype = numpy.float64)
+        crossAxis = numpy.cross(normal, axis)
+        sliceNodes.extend(self.longitudinalSliceNodes)
+        matrices.append(PathGeometry.frameMatrices(origin, axis, crossAxis))
+        matrices.append(PathGeometry.frameMatrices(origin, crossAxis, -axis))
+    slicer.app.pauseRender()
+    try:
+        wasModified = [sliceNode.StartModify() for sliceNode in sliceNodes]
+        for sliceNode, matrix in zip(sliceNodes, matrices):
+            sliceToRAS = sliceNode.GetSliceToRAS()
+            for row in range(3):
+                for column in range(4):
+                    sliceToRAS.SetElement(row, column, matrix[row, column])
+            sliceNode.UpdateMatrices()
+        for sliceNode, modified in zip(sliceNodes, wasModified):
+            sliceNode.EndModify(modified)
+    finally:
+        slicer.app.resumeRender()
+
+  # Drive the two other slice views along the path, as longitudinal views
+  def setLongitudinalViewsEnabled(self, enabled):
+    self.longitudinalViewsEnabled = enabled
+    self.updateLongitudinalSliceNodes()
+
+  # The two slice nodes other than the cross-section's, in Red, Green, Yellow order
+  def updateLongitudinalSliceNodes(self):
+    for sliceNode in self.longitudinalSliceNodes:
+        sliceNode.SetOrientationToDefault()
+    self.longitudinalSliceNodes = []
+    if not self.longitudinalViewsEnabled or self.inputSliceNode is None:
+        return
+    for sliceNodeID in ("vtkMRMLSliceNodeRed", "vtkMRMLSliceNodeGreen", "vtkMRMLSliceNodeYellow"):
+        sliceNode = slicer.mrmlScene.GetNodeByID(sliceNodeID)
+        if sliceNode is not None and sliceNode is not self.inputSliceNode:
+            self.longitudinalSliceNodes.append(sliceNode)
+    if len(self.longitudinalSliceNodes) != 2:
+        self.longitudinalSliceNodes = []
+
+  # Move the reformated slice along path, at right angle to the path.
+  # The frame is looked up in the table, nothing is computed here.
+  @Instrumentation.instrumented()
   def process(self, value):
     if self.inputSliceNode is None or self.inputPath is None or (self.pathArray.size == 0):
         return
-    point = self.pathArray[int(value)]
-    direction = self.pathArray[int(value) + 1] - point
-    self.reformatLogic.SetSliceOrigin(self.inputSliceNode, point[0], point[1], point[2])
-    self.reformatLogic.SetSliceNormal(self.inputSliceNode, direction[0], direction[1], direction[2])
+    if self.distanceMode:
+        self.processDistance(value)
+        return
+    pointIndex = int(value)
+    self.setSliceFrame(self.pathArray[pointIndex], self.frameNormals[pointIndex], self.frameAxes[pointIndex])
     self.lastValue = value
 
+  # Move the reformated slice to a distance in mm from start of path.
+  # The frame is interpolated within the segment containing that distance.
+  @Instrumentation.instrumented()
+  def processDistance(self, distance):
+    if self.inputSliceNode is None or self.inputPath is None or (self.pathArray.size == 0):
+        return
+    origin, normal, axis = PathGeometry.interpolateFrames(self.pathArray, self.frameNormals, self.frameAxes, self.cumDistancesArray, distance)
+    self.setSliceFrame(origin, normal, axis)
+    self.lastValue = distance
+
+  @Instrumentation.instrumented()
   def selectNode(self, inputPath):
     # Observe the selected markup path only. Remove from previous.
     self.removeMarkupObservers()
     self.inputPath = inputPath
     self.resetSliceNodeOrientationToDefault()
-    self.fillPathArray()
+    self.branchSelection = self.getDefaultBranchSelection()
+    self.fillPathArray(cached = True)
     self.addMarkupObservers()
     
+  @Instrumentation.instrumented()
   def selectView(self, sliceMRMLNodeName):
     self.inputSliceNode = slicer.util.getNode(sliceMRMLNodeName)
+    self.updateLongitudinalSliceNodes()
     slicer.modules.reformat.widgetRepresentation().setEditedNode(slicer.util.getNode(sliceMRMLNodeName))
     
   def addMarkupObservers(self):
@@ -413,40 +1216,250 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
         self.inputPath.RemoveObserver(self.markupPointAddedObserver)
         
   # Reposition the slice if a markup control point is moved
+  @Instrumentation.instrumented()
   def onMarkupPointEndInteraction(self, caller, event):
-    self.fillPathArray()
+    self.updatePathArray()
     self.process(self.lastValue)
     
   # Reposition the slice to start if a markup control point is removed
+  @Instrumentation.instrumented()
   def onMarkupPointRemoved(self, caller, event):
-    self.fillPathArray()
+    self.updatePathArray()
     self.process(0)
 
   # Reposition the slice to start if a markup control point is added
+  @Instrumentation.instrumented()
   def onMarkupPointAdded(self, caller, event):
-    self.fillPathArray()
+    self.updatePathArray()
     self.process(0)
     
   # Get RAS current position on path
+  @Instrumentation.instrumented()
   def currentPosition(self, value):
     if self.pathArray.size == 0:
         return numpy.zeros(0)
+    if self.distanceMode:
+        return PathGeometry.interpolateAtDistance(self.pathArray, self.cumDistancesArray, value)
     return self.pathArray[int(value)]
+
+  # VMTK centerline radius at current position on path
+  @Instrumentation.instrumented()
+  def currentRadius(self, value):
+    if self.vmtkCenterlineRadii.size == 0:
+        return 0.0
+    if self.distanceMode:
+        return PathGeometry.interpolateAtDistance(self.vmtkCenterlineRadii, self.cumDistancesArray, value)
+    return self.vmtkCenterlineRadii[int(value)]
   
-  # Calculate distance of each point from start of path
+  # Calculate distance of each point from start of path.
+  # The geometry kernel works on the whole array at once, without a Python loop.
+  @Instrumentation.instrumented()
   def cumulateDistances(self):
-    self.cumDistancesArray = numpy.zeros(int(self.pathArray.size / 3))
-    previous = self.pathArray[0]
-    dist = 0
-    for i, point in enumerate(self.pathArray):
-      # https://stackoverflow.com/questions/1401712/how-can-the-euclidean-distance-be-calculated-with-numpy
-      dist += numpy.linalg.norm(point - previous)
-      self.cumDistancesArray[i] = dist
-      previous = point
+    self.cumDistancesArray = PathGeometry.cumulativeDistances(self.pathArray)
+    self.pathBounds = PathGeometry.pathBounds(self.pathArray)
+
+  # RAS to IJK matrix of a volume, including a linear parent transform
+  def getVolumeRASToIJK(self, volumeNode):
+    rasToIJK = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(rasToIJK)
+    transformNode = volumeNode.GetParentTransformNode()
+    if transformNode is not None:
+        if not transformNode.IsTransformToWorldLinear():
+            raise ValueError("Volume " + volumeNode.GetName() + " is under a non-linear transform. Harden it first.")
+        worldToVolume = vtk.vtkMatrix4x4()
+        transformNode.GetMatrixTransformFromWorld(worldToVolume)
+        vtk.vtkMatrix4x4.Multiply4x4(rasToIJK, worldToVolume, rasToIJK)
+    return slicer.util.arrayFromVTKMatrix(rasToIJK)
+
+  # Axis aligned boxes covering the path tile by tile along the arc length, padded by radius.
+  # Returns the start and end distances of the tiles, and their RAS bounds.
+  def getPathTiles(self, radius, tileLength, overlap):
+    return PathGeometry.pathTiles(self.pathArray, self.cumDistancesArray, radius, tileLength, overlap)
+
+  # One ROI node per tile of the current path, for Crop Volume or any ROI based processing
+  @Instrumentation.instrumented()
+  def createTileROIs(self, radius, tileLength, overlap, baseName = "Tile"):
+    if self.inputPath is None:
+        return []
+    tileStarts, tileEnds, tileBounds = self.getPathTiles(radius, tileLength, overlap)
+    roiNodes = []
+    for tile, bounds in enumerate(tileBounds):
+        roi = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLAnnotationROINode", baseName + " " + str(tile + 1))
+        roi.SetXYZ((bounds[0::2] + bounds[1::2]) / 2.0)
+        halfSizes = (bounds[1::2] - bounds[0::2]) / 2.0
+        roi.SetRadiusXYZ(halfSizes[0], halfSizes[1], halfSizes[2])
+        roiNodes.append(roi)
+    self.tileROINodes.setdefault(self.inputPath.GetID(), []).extend(roiNodes)
+    return roiNodes
+
+  # Remove the tile ROIs created for the current path. Those of other paths are kept.
+  def removeTileROIs(self):
+    if self.inputPath is None:
+        return
+    for roi in self.tileROINodes.pop(self.inputPath.GetID(), []):
+        if slicer.mrmlScene.IsNodePresent(roi):
+            slicer.mrmlScene.RemoveNode(roi)
+
+  # Straightened volume along the whole path, in one batch : slice k is the cross-section
+  # at k * sliceSpacing from start of path. Chunks of slices are sampled in worker threads
+  # and written directly in the output image. The input voxels are read through a view, never copied.
+  @Instrumentation.instrumented()
+  def createStraightenedVolume(self, inputVolume, outputVolume, sliceSpacing, fieldOfView, numberOfThreads = None, slicesPerChunk = 8):
+    if self.pathArray.size == 0:
+        raise ValueError("No path selected.")
+    if sliceSpacing <= 0.0 or fieldOfView <= 0.0:
+        raise ValueError("Slice spacing and field of view must be positive.")
+    pixelSpacing = min(inputVolume.GetSpacing())
+    distances = numpy.arange(0.0, self.pathLength() + sliceSpacing / 2.0, sliceSpacing)
+    origins, normals, axes = self.framesAtDistances(distances)
+    voxels = slicer.util.arrayFromVolume(inputVolume)
+    rasToIJK = self.getVolumeRASToIJK(inputVolume)
+    # Output image allocated once, at its final size
+    numberOfPixels = VolumeSampling.gridSize(fieldOfView, pixelSpacing)
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(numberOfPixels, numberOfPixels, distances.size)
+    imageData.AllocateScalars(vtk.VTK_FLOAT, 1)
+    outputVolume.SetAndObserveImageData(imageData)
+    outputVolume.SetIJKToRASDirections(1, 0, 0, 0, 1, 0, 0, 0, 1)
+    outputVolume.SetSpacing(pixelSpacing, pixelSpacing, sliceSpacing)
+    halfSide = (numberOfPixels - 1) * pixelSpacing / 2.0
+    outputVolume.SetOrigin(-halfSide, -halfSide, 0.0)
+    outputArray = slicer.util.arrayFromVolume(outputVolume)
+
+    def sampleChunk(firstSlice):
+        lastSlice = min(firstSlice + slicesPerChunk, distances.size)
+        grid = VolumeSampling.crossSectionGrid(origins[firstSlice:lastSlice], normals[firstSlice:lastSlice],
+            axes[firstSlice:lastSlice], fieldOfView, pixelSpacing)
+        outputArray[firstSlice:lastSlice] = VolumeSampling.sampleVolume(voxels, rasToIJK, grid)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = numberOfThreads) as executor:
+        # list() re-raises exceptions of the workers
+        list(executor.map(sampleChunk, range(0, distances.size, slicesPerChunk)))
+    slicer.util.arrayFromVolumeModified(outputVolume)
+    if outputVolume.GetDisplayNode() is None:
+        outputVolume.CreateDefaultDisplayNodes()
+    return outputVolume
+
+  # Statistics of all cross-sections along the path, without moving any view.
+  # Per position : mean, maximum and minimum intensity within radius, and area of pixels at or above threshold.
+  # Positions are sampled together, in chunks, by VolumeSampling.crossSectionStatistics.
+  @Instrumentation.instrumented()
+  def computeCrossSectionStatistics(self, inputVolume, tableNode, spacing, radius, threshold):
+    if self.pathArray.size == 0:
+        raise ValueError("No path selected.")
+    if spacing <= 0.0 or radius <= 0.0:
+        raise ValueError("Spacing and radius must be positive.")
+    distances = numpy.arange(0.0, self.pathLength() + spacing / 2.0, spacing)
+    origins, normals, axes = self.framesAtDistances(distances)
+    pixelSpacing = min(inputVolume.GetSpacing())
+    means, maxima, minima, lumenAreas = VolumeSampling.crossSectionStatistics(slicer.util.arrayFromVolume(inputVolume),
+        self.getVolumeRASToIJK(inputVolume), origins, normals, axes, radius, pixelSpacing, threshold)
+    slicer.util.updateTableFromArray(tableNode, [distances, means, maxima, minima, lumenAreas],
+        ["Distance", "Mean", "Maximum", "Minimum", "Lumen area"])
+    tableNode.GetTable().Modified()
+    return tableNode
+
+  # Plot of mean intensity and lumen area along the path, from a statistics table
+  def showStatisticsPlot(self, tableNode):
+    chartNode = slicer.mrmlScene.GetFirstNodeByName(tableNode.GetName() + " chart")
+    if chartNode is None:
+        chartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", tableNode.GetName() + " chart")
+    chartNode.SetXAxisTitle("Distance (mm)")
+    chartNode.RemoveAllPlotSeriesNodeIDs()
+    for columnName in ("Mean", "Lumen area"):
+        seriesName = tableNode.GetName() + " " + columnName
+        seriesNode = slicer.mrmlScene.GetFirstNodeByName(seriesName)
+        if seriesNode is None:
+            seriesNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode", seriesName)
+        seriesNode.SetAndObserveTableNodeID(tableNode.GetID())
+        seriesNode.SetXColumnName("Distance")
+        seriesNode.SetYColumnName(columnName)
+        seriesNode.SetPlotType(slicer.vtkMRMLPlotSeriesNode.PlotTypeScatter)
+        seriesNode.SetMarkerStyle(slicer.vtkMRMLPlotSeriesNode.MarkerStyleNone)
+        chartNode.AddAndObservePlotSeriesNodeID(seriesNode.GetID())
+    if slicer.app.layoutManager() is not None:
+        slicer.modules.plots.logic().ShowChartInLayout(chartNode)
+    return chartNode
+
+  def setCrossSectionCacheEnabled(self, enabled, memoryBudget = 256 * 1024 * 1024):
+    if enabled and self.crossSectionCache is None:
+        self.crossSectionCache = CrossSectionCache.CrossSectionImageCache(memoryBudget)
+    elif not enabled and self.crossSectionCache is not None:
+        self.crossSectionCache.stop()
+        self.crossSectionCache = None
+
+  # A cross-section is identified by the path geometry, its position, the volume content and the sampling geometry.
+  # The branch selection is part of the path geometry : switching branch does not modify the model.
+  def crossSectionKey(self, volumeNode, distance, fieldOfView, pixelSpacing):
+    return (self.inputPath.GetID(), self.frameTableMTime, self.frameTableBranchSelection, round(float(distance), 3),
+        volumeNode.GetID(), volumeNode.GetImageData().GetMTime(), volumeNode.GetMTime(),
+        fieldOfView, pixelSpacing)
+
+  # Functions sampling the cross-section image at each distance. Voxels, matrix and frames are taken here :
+  # sampling in the cache's worker thread does not touch the scene.
+  def crossSectionSamplers(self, volumeNode, distances, fieldOfView, pixelSpacing):
+    voxels = slicer.util.arrayFromVolume(volumeNode)
+    rasToIJK = self.getVolumeRASToIJK(volumeNode)
+    origins, normals, axes = self.framesAtDistances(numpy.asarray(distances, dtype = numpy.float64))
+
+    def sampler(frameIndex):
+        return lambda: VolumeSampling.sampleVolume(voxels, rasToIJK, VolumeSampling.crossSectionGrid(
+            origins[frameIndex], normals[frameIndex], axes[frameIndex], fieldOfView, pixelSpacing))[0]
+
+    return [sampler(i) for i in range(len(distances))]
+
+  # Cross-section image at a position in the current mode, sampled by the module. With the cache enabled,
+  # it is looked up first, and, if prefetch is True, neighbouring positions are sampled ahead.
+  # The slice views reslice on their own : the cache serves measurements, not view rendering.
+  @Instrumentation.instrumented()
+  def getCrossSectionImage(self, volumeNode, value, fieldOfView, pixelSpacing = None, prefetch = True):
+    if pixelSpacing is None:
+        pixelSpacing = min(volumeNode.GetSpacing())
+    distance = self.positionDistance(value)
+    compute = self.crossSectionSamplers(volumeNode, [distance], fieldOfView, pixelSpacing)[0]
+    if self.crossSectionCache is None:
+        return compute()
+    image = self.crossSectionCache.getOrCompute(self.crossSectionKey(volumeNode, distance, fieldOfView, pixelSpacing), compute)
+    if prefetch:
+        self.prefetchCrossSections(volumeNode, value, fieldOfView, pixelSpacing)
+    return image
+
+  # Sample the positions the slider reaches next, one step away each, in the cache's worker thread.
+  # Pending requests for a previous position are replaced.
+  @Instrumentation.instrumented()
+  def prefetchCrossSections(self, volumeNode, value, fieldOfView, pixelSpacing = None):
+    if self.crossSectionCache is None:
+        return
+    if pixelSpacing is None:
+        pixelSpacing = min(volumeNode.GetSpacing())
+    if self.distanceMode:
+        neighbours = [self.positionDistance(value + step * self.distanceStep) for step in range(1, self.prefetchCount + 1)]
+        neighbours += [self.positionDistance(value - step * self.distanceStep) for step in range(1, self.prefetchCount + 1)]
+    else:
+        lastIndex = self.cumDistancesArray.size - 1
+        neighbours = [self.positionDistance(min(int(value) + step, lastIndex)) for step in range(1, self.prefetchCount + 1)]
+        neighbours += [self.positionDistance(max(int(value) - step, 0)) for step in range(1, self.prefetchCount + 1)]
+    samplers = self.crossSectionSamplers(volumeNode, neighbours, fieldOfView, pixelSpacing)
+    self.crossSectionCache.prefetch([(self.crossSectionKey(volumeNode, distance, fieldOfView, pixelSpacing), sampler)
+        for distance, sampler in zip(neighbours, samplers)])
+
+  # While the slider is scrubbed, neighbours of passing positions are not worth sampling
+  def cancelCrossSectionPrefetch(self):
+    if self.crossSectionCache is not None:
+        self.crossSectionCache.cancelPrefetch()
+
+  # Area of pixels at or above threshold within radius, on the cross-section at a position
+  @Instrumentation.instrumented()
+  def getCurrentLumenArea(self, volumeNode, value, radius, threshold, prefetch = True):
+    pixelSpacing = min(volumeNode.GetSpacing())
+    image = self.getCrossSectionImage(volumeNode, value, 2.0 * radius, pixelSpacing, prefetch)
+    mask = VolumeSampling.diskMask(radius, pixelSpacing)
+    return numpy.count_nonzero(mask & (image >= threshold)) * pixelSpacing * pixelSpacing
 
   # This information is added because it is easily available.
   # How useful is it ?
   # In any case, it is the slice orientation in the RAS coordinate system.
+  @Instrumentation.instrumented()
   def getSliceOrientation(self):
     sliceToRAS = self.inputSliceNode.GetSliceToRAS()
     orient = numpy.zeros(3)
@@ -0,0 +1,156 @@
+import heapq
+
+import numpy
+
+from .PathGeometry import segmentLengths
+
+#
+# BranchGraph
+# Topology of a centerline model made of polylines : branches between junctions and end points.
+# Coincident points of different polylines are merged, so that overlapping VMTK centerlines
+# (one per outlet, sharing their proximal part) give one branch per vessel segment.
+#
+
+__all__ = [
+  "cellsFromLegacyArray",
+  "BranchGraph",
+  ]
+
+# Point ids of each cell from a VTK legacy cell array : n, id1, ..., idn, n, ...
+def cellsFromLegacyArray(legacyArray):
+  legacyArray = numpy.asarray(legacyArray, dtype = numpy.int64)
+  cells = []
+  position = 0
+  while position < legacyArray.size:
+    count = int(legacyArray[position])
+    cells.append(legacyArray[position + 1:position + 1 + count])
+    position += count + 1
+  return cells
+
+class BranchGraph(object):
+  """Built once from the points and the polylines of a model.
+  A node is a merged point. A branch is a chain of nodes between two nodes whose degree is not 2.
+  Each branch is stored as original point ids, to read coordinates and radii from the model arrays.
+  """
+
+  def __init__(self, points, cells, tolerance = 1e-4):
+    points = numpy.asarray(points, dtype = numpy.float64).reshape(-1, 3)
+    self.points = points
+    # Merge coincident points : node id of each point, and a representative point of each node
+    quantized = numpy.round(points / tolerance).astype(numpy.int64)
+    uniqueKeys, firstPoints, self.pointNodes = numpy.unique(quantized, axis = 0, return_index = True, return_inverse = True)
+    self.pointNodes = self.pointNodes.reshape(-1)
+    self.nodePoints = firstPoints
+    numberOfNodes = uniqueKeys.shape[0]
+    # Undirected edges between consecutive points of the polylines
+    edgeList = []
+    for cell in cells:
+      cellNodes = self.pointNodes[numpy.asarray(cell, dtype = numpy.int64)]
+      if cellNodes.size > 1:
+        edgeList.append(numpy.stack((cellNodes[:-1], cellNodes[1:]), axis = 1))
+    edges = numpy.concatenate(edgeList) if edgeList else numpy.zeros((0, 2), dtype = numpy.int64)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    edges = numpy.unique(numpy.sort(edges, axis = 1), axis = 0)
+    # Adjacency in compressed rows
+    directed = numpy.concatenate((edges, edges[:, ::-1]))
+    directed = directed[numpy.argsort(directed[:, 0], kind = "stable")]
+    self.degrees = numpy.bincount(directed[:, 0], minlength = numberOfNodes)
+    self.adjacencyOffsets = numpy.zeros(numberOfNodes + 1, dtype = numpy.int64)
+    numpy.cumsum(self.degrees, out = self.adjacencyOffsets[1:])
+    self.adjacency = directed[:, 1]
+    # Start of the first polyline : the inlet of VMTK centerlines
+    self.rootNode = int(self.pointNodes[cells[0][0]]) if len(cells) > 0 and len(cells[0]) > 0 else 0
+    self._buildBranches()
+    self._rootDistances = None
+    self._rootPrevious = None
+
+  def neighbours(self, node):
+    return self.adjacency[self.adjacencyOffsets[node]:self.adjacencyOffsets[node + 1]]
+
+  # Walk chains of degree 2 nodes from each junction or end node, the root first
+  def _buildBranches(self):
+    self.branchNodes = []
+    visitedEdges = set()
+    isStop = self.degrees != 2
+    stopNodes = [self.rootNode] + [int(node) for node in numpy.nonzero(isStop)[0] if node != self.rootNode]
+    for startNode in stopNodes:
+      for nextNode in self.neighbours(startNode):
+        self._walk(startNode, int(nextNode), isStop, visitedEdges)
+    # Closed loops without any junction
+    for node in range(self.degrees.size):
+      for nextNode in self.neighbours(node):
+        if (min(node, nextNode), max(node, nextNode)) not in visitedEdges:
+          self._walk(node, int(nextNode), isStop, visitedEdges, loopStart = node)
+    self.branchPointIds = [self.nodePoints[numpy.array(nodes, dtype = numpy.int64)] for nodes in self.branchNodes]
+    self.branchLengths = numpy.array([segmentLengths(self.points[pointIds]).sum() for pointIds in self.branchPointIds])
+
+  def _walk(self, startNode, nextNode, isStop, visitedEdges, loopStart = None):
+    edge = (min(startNode, nextNode), max(startNode, nextNode))
+    if edge in visitedEdges:
+      return
+    nodes = [startNode]
+    previousNode, node = startNode, nextNode
+    while True:
+      visitedEdges.add((min(previousNode, node), max(previousNode, node)))
+      nodes.append(node)
+      if isStop[node] or node == loopStart:
+        break
+      candidates = [int(candidate) for candidate in self.neighbours(node) if candidate != previousNode]
+      if not candidates or (min(node, candidates[0]), max(node, candidates[0])) in visitedEdges:
+        break
+      previousNode, node = node, candidates[0]
+    self.branchNodes.append(nodes)
+
+  @property
+  def numberOfBranches(self):
+    return len(self.branchNodes)
+
+  # End nodes other than the root : the outlets of VMTK centerlines
+  def endNodes(self):
+    return [int(node) for node in numpy.nonzero(self.degrees == 1)[0] if node != self.rootNode]
+
+  # Shortest distances from the root over the branches (Dijkstra), computed once
+  def _routesFromRoot(self):
+    if self._rootDistances is not None:
+      return
+    self._rootDistances = {self.rootNode : 0.0}
+    self._rootPrevious = {}
+    queue = [(0.0, self.rootNode)]
+    branchesOfNode = {}
+    for branchIndex, nodes in enumerate(self.branchNodes):
+      branchesOfNode.setdefault(nodes[0], []).append(branchIndex)
+      branchesOfNode.setdefault(nodes[-1], []).append(branchIndex)
+    while queue:
+      distance, node = heapq.heappop(queue)
+      if distance > self._rootDistances.get(node, numpy.inf):
+        continue
+      for branchIndex in branchesOfNode.get(node, []):
+        nodes = self.branchNodes[branchIndex]
+        otherNode = nodes[-1] if nodes[0] == node else nodes[0]
+        otherDistance = distance + self.branchLengths[branchIndex]
+        if otherDistance < self._rootDistances.get(otherNode, numpy.inf):
+          self._rootDistances[otherNode] = otherDistance
+          self._rootPrevious[otherNode] = (node, branchIndex)
+          heapq.heappush(queue, (otherDistance, otherNode))
+
+  # Length of the route from the root to a node, or None if not connected
+  def routeLength(self, endNode):
+    self._routesFromRoot()
+    return self._rootDistances.get(endNode)
+
+  # Point ids from the root to a node, junction points not repeated
+  def routePointIds(self, endNode):
+    self._routesFromRoot()
+    if endNode not in self._rootDistances:
+      return numpy.zeros(0, dtype = numpy.int64)
+    parts = []
+    node = endNode
+    while node != self.rootNode:
+      previousNode, branchIndex = self._rootPrevious[node]
+      pointIds = self.branchPointIds[branchIndex]
+      if self.branchNodes[branchIndex][0] != previousNode:
+        pointIds = pointIds[::-1]
+      parts.append(pointIds[1:])
+      node = previousNode
+    parts.append(self.nodePoints[[self.rootNode]])
+    return numpy.concatenate(parts[::-1])
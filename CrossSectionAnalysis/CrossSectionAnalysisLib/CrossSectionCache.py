@@ -0,0 +1,137 @@
+import collections
+import logging
+import threading
+
+#
+# CrossSectionCache
+# Memory bounded LRU cache of sampled cross-section images, with a prefetching worker thread.
+# Keys are any hashable value : the caller includes path, position, volume and slice geometry.
+#
+
+__all__ = [
+  "CrossSectionImageCache",
+  ]
+
+class CrossSectionImageCache(object):
+  """Least recently used images are evicted when the memory budget (bytes) is exceeded.
+  Images are numpy arrays. They are made read-only, as they are shared by all users of the cache.
+  """
+
+  def __init__(self, memoryBudget = 256 * 1024 * 1024):
+    self.memoryBudget = memoryBudget
+    self.images = collections.OrderedDict()
+    self.memoryUsed = 0
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    # Pending prefetch requests : key -> function computing the image
+    self.prefetchRequests = collections.OrderedDict()
+    self.prefetchCondition = threading.Condition(self.lock)
+    self.prefetchThread = None
+    self.stopping = False
+
+  # Cached image, or None. Counts a hit or a miss.
+  def get(self, key):
+    with self.lock:
+      image = self.images.get(key)
+      if image is None:
+        self.misses += 1
+        return None
+      self.images.move_to_end(key)
+      self.hits += 1
+      return image
+
+  def put(self, key, image):
+    with self.lock:
+      self._put(key, image)
+
+  # Cached image, or computed now and cached
+  def getOrCompute(self, key, compute):
+    image = self.get(key)
+    if image is None:
+      image = compute()
+      self.put(key, image)
+    return image
+
+  # Called with the lock held
+  def _put(self, key, image):
+    previous = self.images.pop(key, None)
+    if previous is not None:
+      self.memoryUsed -= previous.nbytes
+    if image.nbytes > self.memoryBudget:
+      return
+    image.setflags(write = False)
+    self.images[key] = image
+    self.memoryUsed += image.nbytes
+    while self.memoryUsed > self.memoryBudget:
+      evictedKey, evicted = self.images.popitem(last = False)
+      self.memoryUsed -= evicted.nbytes
+
+  # Compute images in the worker thread, in the given order.
+  # Pending requests are replaced : only the neighbourhood of the latest position matters.
+  # The compute functions run outside of the main thread : they must not use the MRML scene.
+  def prefetch(self, requests):
+    with self.prefetchCondition:
+      self.prefetchRequests.clear()
+      for key, compute in requests:
+        if key not in self.images:
+          self.prefetchRequests[key] = compute
+      if not self.prefetchRequests:
+        return
+      if self.prefetchThread is None:
+        self.stopping = False
+        self.prefetchThread = threading.Thread(target = self._prefetchLoop, name = "CrossSectionPrefetch")
+        self.prefetchThread.daemon = True
+        self.prefetchThread.start()
+      self.prefetchCondition.notify()
+
+  # Drop the pending requests. The image being computed, if any, is still cached.
+  def cancelPrefetch(self):
+    with self.prefetchCondition:
+      self.prefetchRequests.clear()
+
+  def _prefetchLoop(self):
+    while True:
+      with self.prefetchCondition:
+        while not self.prefetchRequests and not self.stopping:
+          self.prefetchCondition.wait()
+        if self.stopping:
+          return
+        key, compute = self.prefetchRequests.popitem(last = False)
+        if key in self.images:
+          continue
+      try:
+        image = compute()
+      except Exception as e:
+        logging.warning("Cross-section prefetch failed: " + str(e))
+        continue
+      with self.lock:
+        self._put(key, image)
+
+  # Stop the worker thread. The cache remains usable.
+  def stop(self):
+    with self.prefetchCondition:
+      self.stopping = True
+      self.prefetchRequests.clear()
+      self.prefetchCondition.notify()
+    if self.prefetchThread is not None:
+      self.prefetchThread.join()
+      self.prefetchThread = None
+
+  def clear(self):
+    with self.lock:
+      self.images.clear()
+      self.prefetchRequests.clear()
+      self.memoryUsed = 0
+      self.hits = 0
+      self.misses = 0
+
+  def statistics(self):
+    with self.lock:
+      return {
+        "hits" : self.hits,
+        "misses" : self.misses,
+        "images" : len(self.images),
+        "memoryUsed" : self.memoryUsed,
+        "memoryBudget" : self.memoryBudget,
+        }
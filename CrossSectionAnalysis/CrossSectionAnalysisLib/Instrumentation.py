@@ -0,0 +1,148 @@
+import contextlib
+import functools
+import inspect
+import json
+import threading
+import time
+
+#
+# Instrumentation
+# Call counts, cumulative time and latency histograms of handlers.
+# Disabled by default : an instrumented call then costs one flag test.
+#
+
+__all__ = [
+  "instrumented",
+  "section",
+  "setEnabled",
+  "isEnabled",
+  "reset",
+  "statistics",
+  "formatReport",
+  "saveReport",
+  ]
+
+# Upper bounds of the latency histogram buckets, in seconds : 10 us to 1 s, and more
+HISTOGRAM_BOUNDS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)
+HISTOGRAM_LABELS = ("<10us", "<100us", "<1ms", "<10ms", "<100ms", "<1s", ">=1s")
+
+class _State(object):
+  enabled = False
+
+_state = _State()
+_lock = threading.Lock()
+_statistics = {}
+
+class HandlerStatistics(object):
+  def __init__(self):
+    self.count = 0
+    self.totalTime = 0.0
+    self.maximumTime = 0.0
+    self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+  def add(self, elapsed):
+    self.count += 1
+    self.totalTime += elapsed
+    self.maximumTime = max(self.maximumTime, elapsed)
+    bucket = 0
+    while bucket < len(HISTOGRAM_BOUNDS) and elapsed >= HISTOGRAM_BOUNDS[bucket]:
+      bucket += 1
+    self.histogram[bucket] += 1
+
+  def toDictionary(self):
+    return {
+      "count" : self.count,
+      "totalTime" : self.totalTime,
+      "meanTime" : self.totalTime / self.count if self.count else 0.0,
+      "maximumTime" : self.maximumTime,
+      "histogram" : dict(zip(HISTOGRAM_LABELS, self.histogram)),
+      }
+
+def _record(name, elapsed):
+  with _lock:
+    handlerStatistics = _statistics.get(name)
+    if handlerStatistics is None:
+      handlerStatistics = _statistics[name] = HandlerStatistics()
+    handlerStatistics.add(elapsed)
+
+# Wrapper calling call(*arguments) with the same parameters as function, and the same number of them in its code.
+# PythonQt passes a slot as many signal arguments as its code declares : a (*args, **kwargs) wrapper would receive
+# all of them, and the wrapped handler would fail if it takes fewer.
+def _fixedSignatureWrapper(function, call):
+  parameters = list(inspect.signature(function).parameters.values())
+  if any(parameter.kind != inspect.Parameter.POSITIONAL_OR_KEYWORD for parameter in parameters):
+    wrapper = lambda *args, **kwargs: call(*args, **kwargs)
+    return functools.update_wrapper(wrapper, function)
+  defaults = [parameter.default for parameter in parameters]
+  definitions = [parameter.name if parameter.default is inspect.Parameter.empty
+    else "%s = _defaults[%d]" % (parameter.name, index) for index, parameter in enumerate(parameters)]
+  names = ", ".join(parameter.name for parameter in parameters)
+  source = "def wrapper(%s):\n  return _call(%s)\n" % (", ".join(definitions), names)
+  namespace = {"_call" : call, "_defaults" : defaults}
+  exec(source, namespace)
+  return functools.update_wrapper(namespace["wrapper"], function)
+
+# Decorator measuring each call of a function or method, under its qualified name by default.
+# The wrapper keeps the function's parameters : Qt signals connected to it pass the same arguments.
+def instrumented(name = None):
+  def decorator(function):
+    handlerName = name or function.__qualname__
+    def call(*args, **kwargs):
+      if not _state.enabled:
+        return function(*args, **kwargs)
+      start = time.perf_counter()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        _record(handlerName, time.perf_counter() - start)
+    return _fixedSignatureWrapper(function, call)
+  return decorator
+
+_nullContext = contextlib.nullcontext()
+
+@contextlib.contextmanager
+def _measuredSection(name):
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    _record(name, time.perf_counter() - start)
+
+# Context manager measuring a part of a function, like an array export
+def section(name):
+  if not _state.enabled:
+    return _nullContext
+  return _measuredSection(name)
+
+def setEnabled(enabled):
+  _state.enabled = enabled
+
+def isEnabled():
+  return _state.enabled
+
+def reset():
+  with _lock:
+    _statistics.clear()
+
+# Statistics of each measured name, as dictionaries
+def statistics():
+  with _lock:
+    return {name : handlerStatistics.toDictionary() for name, handlerStatistics in _statistics.items()}
+
+# Text table, most time consuming first
+def formatReport():
+  handlerStatistics = sorted(statistics().items(), key = lambda item: item[1]["totalTime"], reverse = True)
+  lines = ["%-44s %8s %10s %10s %10s  %s" % ("Handler", "Calls", "Total ms", "Mean ms", "Max ms", " ".join(HISTOGRAM_LABELS))]
+  for name, values in handlerStatistics:
+    lines.append("%-44s %8d %10.2f %10.3f %10.2f  %s" % (name, values["count"], values["totalTime"] * 1e3,
+      values["meanTime"] * 1e3, values["maximumTime"] * 1e3,
+      " ".join(str(values["histogram"][label]) for label in HISTOGRAM_LABELS)))
+  return "\n".join(lines)
+
+# JSON if the file name ends with .json, else the text table
+def saveReport(fileName):
+  with open(fileName, "w") as reportFile:
+    if fileName.lower().endswith(".json"):
+      json.dump(statistics(), reportFile, indent = 1)
+    else:
+      reportFile.write(formatReport() + "\n")
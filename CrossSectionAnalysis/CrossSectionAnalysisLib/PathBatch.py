@@ -0,0 +1,411 @@
+import argparse
+import collections
+import concurrent.futures
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+
+import numpy
+
+from . import PathGeometry, VolumeSampling, BranchGraph
+
+#
+# PathBatch
+# Profiles of many paths, without a scene, a view or a layout manager.
+# Paths are point arrays, or model and markups files. They are spread across a process pool,
+# one result file per path and a summary file are written. A model holding several centerlines
+# gives one path per route, from the inlet to each outlet.
+#
+# Command line, from the module's directory :
+#   PythonSlicer -m CrossSectionAnalysisLib.PathBatch -o output centerline1.vtp centerline2.vtp ...
+# or, to interpolate markups curves and to load volumes with Slicer's readers :
+#   Slicer --no-main-window --python-code "from CrossSectionAnalysisLib import PathBatch; PathBatch.main(['-o', 'output', ...]); exit()"
+#
+
+__all__ = [
+  "modelRoutes",
+  "readPathRoutes",
+  "readPathFile",
+  "computePathProfile",
+  "writeProfile",
+  "runBatch",
+  "main",
+  ]
+
+PATH_FILE_EXTENSIONS = (".vtk", ".vtp", ".mrk.json", ".npy")
+
+def _slicerAvailable():
+  try:
+    import slicer
+    return slicer.mrmlScene is not None
+  except (ImportError, AttributeError):
+    return False
+
+# Coordinate system of a model file written by Slicer : 'SPACE' field data array of XML files,
+# 'SPACE=...' in the header of legacy files. Files without it are read as LPS, as Slicer does.
+def _polyDataCoordinateSystem(reader, polyData):
+  spaceArray = polyData.GetFieldData().GetAbstractArray("SPACE")
+  if spaceArray is not None and spaceArray.GetNumberOfValues() > 0:
+    return spaceArray.GetVariantValue(0).ToString().upper()
+  header = reader.GetHeader() if hasattr(reader, "GetHeader") else None
+  if header and "SPACE=RAS" in header.upper():
+    return "RAS"
+  return "LPS"
+
+# VTK polydata of a model file, with points in RAS. In Slicer, the model is loaded as in the scene.
+def _readPolyData(fileName):
+  if _slicerAvailable():
+    import slicer
+    import vtk
+    modelNode = slicer.util.loadModel(fileName)
+    if modelNode is None or modelNode.GetPolyData() is None:
+      raise ValueError("Could not load " + fileName)
+    try:
+      polyData = vtk.vtkPolyData()
+      polyData.DeepCopy(modelNode.GetPolyData())
+      return polyData
+    finally:
+      slicer.mrmlScene.RemoveNode(modelNode)
+  import vtk
+  from vtk.util.numpy_support import vtk_to_numpy
+  if fileName.lower().endswith(".vtp"):
+    reader = vtk.vtkXMLPolyDataReader()
+  else:
+    reader = vtk.vtkPolyDataReader()
+  reader.SetFileName(fileName)
+  reader.Update()
+  polyData = reader.GetOutput()
+  if polyData is None or polyData.GetPoints() is None:
+    raise ValueError("No points in " + fileName)
+  if _polyDataCoordinateSystem(reader, polyData) == "LPS":
+    points = vtk_to_numpy(polyData.GetPoints().GetData())
+    points[:, 0:2] *= -1.0
+    polyData.GetPoints().Modified()
+  return polyData
+
+# Points (RAS), radii and polylines of a VTK polydata file.
+# Radii are None if there is no 'Radius' point array. Polylines are arrays of point ids.
+def _readPolyDataFile(fileName):
+  from vtk.util.numpy_support import vtk_to_numpy
+  polyData = _readPolyData(fileName)
+  if polyData.GetPoints() is None:
+    raise ValueError("No points in " + fileName)
+  points = vtk_to_numpy(polyData.GetPoints().GetData()).astype(numpy.float64)
+  radiusArray = polyData.GetPointData().GetArray("Radius")
+  radii = vtk_to_numpy(radiusArray).astype(numpy.float64) if radiusArray is not None else None
+  cells = BranchGraph.cellsFromLegacyArray(vtk_to_numpy(polyData.GetLines().GetData())) if polyData.GetNumberOfLines() > 0 else []
+  return points, radii, cells
+
+# Routes of a model, as a list of (points, radii) : from the inlet to each outlet of its branch graph.
+# Overlapping VMTK centerlines share their proximal points, which are not merged into a single path.
+# A model without polylines is one path of all its points. A closed loop gives its branches.
+def modelRoutes(points, radii, cells):
+  points = numpy.asarray(points, dtype = numpy.float64).reshape(-1, 3)
+  if len(cells) == 0:
+    return [(points, radii)]
+  graph = BranchGraph.BranchGraph(points, cells)
+  routePointIds = [graph.routePointIds(endNode) for endNode in graph.endNodes()]
+  if not routePointIds:
+    routePointIds = graph.branchPointIds
+  return [(points[pointIds], radii[pointIds] if radii is not None else None)
+    for pointIds in routePointIds if pointIds.size > 1]
+
+# Points of a markups file. In Slicer, the curve is interpolated as in the scene.
+# Otherwise, the control points are used as they are.
+def _readMarkupsFile(fileName):
+  if _slicerAvailable():
+    import slicer
+    markupsNode = slicer.util.loadMarkups(fileName)
+    if markupsNode is None:
+      raise ValueError("Could not load " + fileName)
+    try:
+      return numpy.array(slicer.util.arrayFromMarkupsCurvePoints(markupsNode), dtype = numpy.float64), None
+    finally:
+      slicer.mrmlScene.RemoveNode(markupsNode)
+  with open(fileName) as markupsFile:
+    content = json.load(markupsFile)
+  markups = content["markups"][0]
+  points = numpy.array([controlPoint["position"] for controlPoint in markups["controlPoints"]], dtype = numpy.float64).reshape(-1, 3)
+  if markups.get("coordinateSystem", "LPS") == "LPS":
+    points[:, 0:2] *= -1.0
+  return points, None
+
+# Paths of a file, as a list of (points (N x 3), radii (N values, or None)).
+# A model gives one path per route, other files a single path.
+def readPathRoutes(fileName):
+  lowerName = fileName.lower()
+  if lowerName.endswith(".vtk") or lowerName.endswith(".vtp"):
+    return modelRoutes(*_readPolyDataFile(fileName))
+  return [readPathFile(fileName)]
+
+# Points (N x 3) and radii (N values, or None) of a path file.
+# A .npy array may have a fourth column holding radii. A model must hold a single route.
+def readPathFile(fileName):
+  lowerName = fileName.lower()
+  if lowerName.endswith(".vtk") or lowerName.endswith(".vtp"):
+    routes = readPathRoutes(fileName)
+    if len(routes) != 1:
+      raise ValueError(fileName + " holds " + str(len(routes)) + " routes : use readPathRoutes")
+    return routes[0]
+  if lowerName.endswith(".mrk.json"):
+    return _readMarkupsFile(fileName)
+  if lowerName.endswith(".npy"):
+    array = numpy.load(fileName)
+    if array.ndim != 2 or array.shape[1] not in (3, 4):
+      raise ValueError(fileName + " is not an N x 3 or N x 4 array")
+    radii = array[:, 3].astype(numpy.float64) if array.shape[1] == 4 else None
+    return array[:, :3].astype(numpy.float64), radii
+  raise ValueError("Unsupported path file: " + fileName)
+
+# Arc length, frames, radii and, if a volume is given, cross-section statistics along a path.
+# volume is (voxels, rasToIJK) or None. statisticsParameters is (spacing, radius, threshold).
+# Returns a dictionary of arrays, one value per sampled position.
+def computePathProfile(points, radii = None, halfWidth = 2, volume = None, statisticsParameters = (1.0, 10.0, 150.0)):
+  points = numpy.asarray(points, dtype = numpy.float64).reshape(-1, 3)
+  if points.shape[0] < 2:
+    raise ValueError("A path needs at least 2 points")
+  cumDistances = PathGeometry.cumulativeDistances(points)
+  normals, axes = PathGeometry.computeFrames(points, halfWidth)
+  if volume is None:
+    profile = {
+      "distance" : cumDistances,
+      "points" : points,
+      "normals" : normals,
+      "axes" : axes,
+      }
+    if radii is not None:
+      profile["radius"] = numpy.asarray(radii, dtype = numpy.float64)
+    return profile
+  # Regular positions along the path for statistics
+  spacing, radius, threshold = statisticsParameters
+  distances = numpy.arange(0.0, cumDistances[-1] + spacing / 2.0, spacing)
+  origins, sampledNormals, sampledAxes = PathGeometry.interpolateFrames(points, normals, axes, cumDistances, distances)
+  voxels, rasToIJK = volume
+  pixelSpacing = _pixelSpacing(rasToIJK)
+  means, maxima, minima, lumenAreas = VolumeSampling.crossSectionStatistics(voxels, rasToIJK, origins,
+    sampledNormals, sampledAxes, radius, pixelSpacing, threshold)
+  profile = {
+    "distance" : distances,
+    "points" : origins,
+    "normals" : sampledNormals,
+    "axes" : sampledAxes,
+    "mean" : means,
+    "maximum" : maxima,
+    "minimum" : minima,
+    "lumenArea" : lumenAreas,
+    }
+  if radii is not None:
+    profile["radius"] = PathGeometry.interpolateAtDistance(numpy.asarray(radii, dtype = numpy.float64), cumDistances, distances)
+  return profile
+
+# Smallest voxel spacing, from the RAS to IJK matrix
+def _pixelSpacing(rasToIJK):
+  ijkToRAS = numpy.linalg.inv(numpy.asarray(rasToIJK, dtype = numpy.float64))
+  return float(numpy.linalg.norm(ijkToRAS[:3, :3], axis = 0).min())
+
+# One row per position : distance, RAS point, normal, then radius and statistics if available
+def writeProfile(fileName, profile):
+  columns = [("Distance", profile["distance"])]
+  for name, key in (("R", 0), ("A", 1), ("S", 2)):
+    columns.append((name, profile["points"][:, key]))
+  for name, key in (("NormalR", 0), ("NormalA", 1), ("NormalS", 2)):
+    columns.append((name, profile["normals"][:, key]))
+  for name, key in (("Radius", "radius"), ("Mean", "mean"), ("Maximum", "maximum"),
+      ("Minimum", "minimum"), ("LumenArea", "lumenArea")):
+    if key in profile:
+      columns.append((name, profile[key]))
+  with open(fileName, "w", newline = "") as profileFile:
+    writer = csv.writer(profileFile)
+    writer.writerow([name for name, values in columns])
+    writer.writerows(numpy.column_stack([values for name, values in columns]).tolist())
+
+# Summary of a profile, for the summary file
+def _summarize(profile):
+  summary = {
+    "Length" : float(profile["distance"][-1]),
+    "Positions" : int(profile["distance"].size),
+    }
+  for key, name in (("radius", "Radius"), ("lumenArea", "LumenArea")):
+    if key in profile and profile[key].size > 0:
+      summary["Minimum" + name] = float(profile[key].min())
+      summary["Mean" + name] = float(profile[key].mean())
+      summary["Maximum" + name] = float(profile[key].max())
+  return summary
+
+#
+# Process pool
+#
+
+# Volume shared by all workers, attached once per worker
+_workerVolume = None
+_workerSharedMemory = None
+
+def _initializeWorker(sharedMemoryName, shape, dtype, rasToIJK):
+  global _workerVolume, _workerSharedMemory
+  if sharedMemoryName is None:
+    return
+  from multiprocessing import shared_memory
+  _workerSharedMemory = shared_memory.SharedMemory(name = sharedMemoryName)
+  voxels = numpy.ndarray(shape, dtype = dtype, buffer = _workerSharedMemory.buf)
+  _workerVolume = (voxels, rasToIJK)
+
+def _processPath(points, radii, outputFileName, halfWidth, statisticsParameters):
+  profile = computePathProfile(points, radii, halfWidth, _workerVolume, statisticsParameters)
+  writeProfile(outputFileName, profile)
+  return _summarize(profile)
+
+# The Slicer executable is not a Python interpreter : workers run in PythonSlicer
+def _multiprocessingContext():
+  context = multiprocessing.get_context("spawn")
+  if "slicer" in sys.modules:
+    executableName = "PythonSlicer.exe" if os.name == "nt" else "PythonSlicer"
+    executable = shutil.which(executableName)
+    if executable is None:
+      import slicer
+      executable = os.path.join(slicer.app.slicerHome, "bin", executableName)
+    context.set_executable(executable)
+  return context
+
+# Load a volume file with Slicer, and copy its voxels once in shared memory for all workers.
+# Returns the shared memory block and the arguments of the worker initializer.
+# The volume is placed by its file's geometry only : transforms of a scene are not applied,
+# so paths and volume files must be saved in the same coordinates.
+def _loadVolumeInSharedMemory(fileName):
+  if not _slicerAvailable():
+    raise ValueError("Volumes are loaded with Slicer's readers : run the batch in Slicer to compute statistics")
+  import slicer
+  import vtk
+  from multiprocessing import shared_memory
+  volumeNode = slicer.util.loadVolume(fileName)
+  try:
+    rasToIJK = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(rasToIJK)
+    voxels = slicer.util.arrayFromVolume(volumeNode)
+    sharedMemory = shared_memory.SharedMemory(create = True, size = max(voxels.nbytes, 1))
+    numpy.ndarray(voxels.shape, dtype = voxels.dtype, buffer = sharedMemory.buf)[...] = voxels
+    return sharedMemory, (sharedMemory.name, voxels.shape, voxels.dtype, slicer.util.arrayFromVTKMatrix(rasToIJK))
+  finally:
+    slicer.mrmlScene.RemoveNode(volumeNode)
+
+# Compute and write the profile of each path file in a process pool.
+# A model with several routes gives one file per route, named <file>_route<k>.csv.
+# Files of the same name in different directories are named after their relative path.
+# Returns the list of summaries, also written to summary.csv in the output directory.
+def runBatch(pathFiles, outputDirectory, numberOfProcesses = None, volumeFile = None,
+    statisticsParameters = (1.0, 10.0, 150.0), halfWidth = 2):
+  os.makedirs(outputDirectory, exist_ok = True)
+  sharedMemory = None
+  initializerArguments = (None, None, None, None)
+  if volumeFile is not None:
+    sharedMemory, initializerArguments = _loadVolumeInSharedMemory(volumeFile)
+  numberOfProcesses = numberOfProcesses or os.cpu_count() or 1
+  summaries = []
+  try:
+    with concurrent.futures.ProcessPoolExecutor(max_workers = numberOfProcesses,
+        mp_context = _multiprocessingContext(), initializer = _initializeWorker,
+        initargs = initializerArguments) as executor:
+      futures = {}
+      for pathFile, name in zip(pathFiles, _outputNames(pathFiles)):
+        try:
+          # Files are read here : in Slicer, markups are interpolated with the scene
+          routes = readPathRoutes(pathFile)
+        except Exception as e:
+          summaries.append({"File" : pathFile, "Route" : 1, "Status" : "Failed: " + str(e)})
+          continue
+        for routeIndex, (points, radii) in enumerate(routes):
+          routeName = name if len(routes) == 1 else name + "_route" + str(routeIndex + 1)
+          outputFileName = os.path.join(outputDirectory, routeName + ".csv")
+          futures[executor.submit(_processPath, points, radii, outputFileName, halfWidth,
+            statisticsParameters)] = (pathFile, routeIndex + 1, outputFileName)
+      for future in concurrent.futures.as_completed(futures):
+        pathFile, route, outputFileName = futures[future]
+        try:
+          summary = {"File" : pathFile, "Route" : route, "Status" : "OK", "Output" : outputFileName}
+          summary.update(future.result())
+        except Exception as e:
+          summary = {"File" : pathFile, "Route" : route, "Status" : "Failed: " + str(e)}
+        logging.info(pathFile + " route " + str(route) + ": " + summary["Status"])
+        summaries.append(summary)
+  finally:
+    if sharedMemory is not None:
+      sharedMemory.close()
+      sharedMemory.unlink()
+  summaries.sort(key = lambda summary: (summary["File"], summary["Route"]))
+  _writeSummary(os.path.join(outputDirectory, "summary.csv"), summaries)
+  return summaries
+
+def _removePathExtension(name):
+  for extension in PATH_FILE_EXTENSIONS:
+    if name.lower().endswith(extension):
+      return name[:-len(extension)]
+  return name
+
+# Output file name of each path file, without extension. Files of the same name in different directories
+# are named after their path from the common directory of all files. Case is ignored, as on some file systems.
+def _outputNames(pathFiles):
+  names = [_removePathExtension(os.path.basename(pathFile)) for pathFile in pathFiles]
+  counts = collections.Counter(name.lower() for name in names)
+  if len(counts) < len(names):
+    commonDirectory = os.path.commonpath([os.path.dirname(os.path.abspath(pathFile)) for pathFile in pathFiles])
+    for index, pathFile in enumerate(pathFiles):
+      if counts[names[index].lower()] > 1:
+        relativePath = os.path.relpath(os.path.abspath(pathFile), commonDirectory)
+        names[index] = _removePathExtension(relativePath).replace(os.sep, "_")
+  # The same file given twice
+  usedNames = set()
+  for index, name in enumerate(names):
+    uniqueName = name
+    suffix = 2
+    while uniqueName.lower() in usedNames:
+      uniqueName = name + "_" + str(suffix)
+      suffix += 1
+    usedNames.add(uniqueName.lower())
+    names[index] = uniqueName
+  return names
+
+def _writeSummary(fileName, summaries):
+  fieldNames = ["File", "Route", "Status", "Output"]
+  for summary in summaries:
+    for key in summary:
+      if key not in fieldNames:
+        fieldNames.append(key)
+  with open(fileName, "w", newline = "") as summaryFile:
+    writer = csv.DictWriter(summaryFile, fieldnames = fieldNames)
+    writer.writeheader()
+    writer.writerows(summaries)
+
+# Path files given on the command line, directories being searched for path files
+def _collectPathFiles(arguments):
+  pathFiles = []
+  for argument in arguments:
+    if os.path.isdir(argument):
+      for name in sorted(os.listdir(argument)):
+        if name.lower().endswith(PATH_FILE_EXTENSIONS):
+          pathFiles.append(os.path.join(argument, name))
+    else:
+      pathFiles.append(argument)
+  return pathFiles
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = "Cross-section analysis of path files, one result file per path and a summary.")
+  parser.add_argument("paths", nargs = "+", help = "Model (.vtk, .vtp), markups (.mrk.json) or point array (.npy) files, or directories of them")
+  parser.add_argument("-o", "--output", required = True, help = "Output directory")
+  parser.add_argument("-j", "--processes", type = int, default = None, help = "Number of worker processes")
+  parser.add_argument("--volume", default = None, help = "Volume to compute cross-section statistics (requires Slicer)")
+  parser.add_argument("--spacing", type = float, default = 1.0, help = "Distance between measured cross-sections (mm)")
+  parser.add_argument("--radius", type = float, default = 10.0, help = "Measurement radius (mm)")
+  parser.add_argument("--threshold", type = float, default = 150.0, help = "Lumen threshold")
+  parser.add_argument("--smoothing", type = int, default = 2, help = "Points on each side averaged for the tangent")
+  arguments = parser.parse_args(argv)
+  logging.basicConfig(level = logging.INFO)
+  summaries = runBatch(_collectPathFiles(arguments.paths), arguments.output, arguments.processes, arguments.volume,
+    (arguments.spacing, arguments.radius, arguments.threshold), arguments.smoothing)
+  failures = [summary for summary in summaries if summary["Status"] != "OK"]
+  return 1 if failures else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
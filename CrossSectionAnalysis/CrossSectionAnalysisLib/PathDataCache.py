@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy
+
+#
+# PathDataCache
+# Persistent cache of arrays computed from a path, one .npz file per key, in a directory.
+# Keys are hashes of the path geometry and of the parameters : a file is valid as long as it exists.
+#
+
+__all__ = [
+  "PathDataCache",
+  ]
+
+class PathDataCache(object):
+  """Least recently used files are deleted when the directory's files exceed maximumSize (bytes).
+  Loading a file marks it as used.
+  """
+
+  # Incremented when the stored arrays change meaning : older files are then never matched
+  FORMAT_VERSION = 1
+
+  def __init__(self, directory, maximumSize = 512 * 1024 * 1024):
+    self.directory = directory
+    self.maximumSize = maximumSize
+
+  # SHA-1 of the points and of the parameters, given as a dictionary of plain values
+  def key(self, points, parameters = None):
+    points = numpy.ascontiguousarray(points)
+    digest = hashlib.sha1()
+    digest.update(str((self.FORMAT_VERSION, points.dtype.str, points.shape)).encode())
+    digest.update(points.data)
+    if parameters:
+      digest.update(repr(sorted(parameters.items())).encode())
+    return digest.hexdigest()
+
+  def fileName(self, key):
+    return os.path.join(self.directory, key + ".npz")
+
+  # Dictionary of arrays, or None if not cached or unreadable
+  def load(self, key):
+    fileName = self.fileName(key)
+    if not os.path.isfile(fileName):
+      return None
+    try:
+      with numpy.load(fileName, allow_pickle = False) as data:
+        arrays = {name : data[name] for name in data.files}
+      os.utime(fileName)
+    except (OSError, ValueError) as e:
+      logging.warning("Path data cache file " + fileName + " is unreadable: " + str(e))
+      return None
+    return arrays
+
+  # Write to a temporary file first : an interrupted write never leaves a truncated file under the key
+  def save(self, key, arrays):
+    try:
+      os.makedirs(self.directory, exist_ok = True)
+      fileDescriptor, temporaryFileName = tempfile.mkstemp(suffix = ".npz.tmp", dir = self.directory)
+      with os.fdopen(fileDescriptor, "wb") as temporaryFile:
+        numpy.savez(temporaryFile, **arrays)
+      os.replace(temporaryFileName, self.fileName(key))
+    except OSError as e:
+      logging.warning("Path data cache could not be written in " + self.directory + ": " + str(e))
+      return
+    self.evict()
+
+  # Delete the least recently used files until the total size fits
+  def evict(self):
+    try:
+      entries = [entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name.endswith(".npz")]
+    except OSError:
+      return
+    files = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries))
+    totalSize = sum(size for modifiedTime, size, path in files)
+    for modifiedTime, size, path in files:
+      if totalSize <= self.maximumSize:
+        break
+      try:
+        os.remove(path)
+        totalSize -= size
+      except OSError:
+        pass
+
+  def clear(self):
+    self.maximumSize, maximumSize = 0, self.maximumSize
+    self.evict()
+    self.maximumSize = maximumSize
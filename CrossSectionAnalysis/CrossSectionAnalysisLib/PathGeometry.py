@@ -0,0 +1,389 @@
+import numpy
+
+#
+# PathGeometry
+# Batched geometry of a path given as an N x 3 array of RAS points.
+# Nothing here requires Slicer : the functions can be called on any numpy array.
+#
+
+__all__ = [
+  "segmentLengths",
+  "cumulativeDistances",
+  "unitTangents",
+  "pathBounds",
+  "pathTiles",
+  "locateDistance",
+  "interpolateAtDistance",
+  "projectNearPoint",
+  "smoothTangents",
+  "parallelTransportAxes",
+  "computeFrames",
+  "interpolateFrames",
+  "frameMatrices",
+  "rotateAroundAxes",
+  "signedAngles",
+  "continueTransport",
+  "changedRange",
+  "curveSpliceRange",
+  "splicePath",
+  ]
+
+# Ensure an N x 3 float array, without copying if the input is already suitable
+def _asPoints(points):
+  points = numpy.asarray(points, dtype = numpy.float64)
+  if points.size == 0:
+    return numpy.zeros((0, 3))
+  return points.reshape(-1, 3)
+
+# Length of each segment joining consecutive points : N - 1 values
+def segmentLengths(points):
+  points = _asPoints(points)
+  if points.shape[0] < 2:
+    return numpy.zeros(0)
+  # https://stackoverflow.com/questions/1401712/how-can-the-euclidean-distance-be-calculated-with-numpy
+  return numpy.linalg.norm(numpy.diff(points, axis = 0), axis = 1)
+
+# Distance of each point from start of path : N values, the first one is 0
+def cumulativeDistances(points):
+  points = _asPoints(points)
+  if points.shape[0] == 0:
+    return numpy.zeros(0)
+  distances = numpy.zeros(points.shape[0])
+  numpy.cumsum(segmentLengths(points), out = distances[1:])
+  return distances
+
+# Unit direction of the path at each point : N x 3 values.
+# Central differences inside the path, one-sided at both ends.
+# Coincident neighbours give a null vector, never a division by zero.
+def unitTangents(points):
+  points = _asPoints(points)
+  numberOfPoints = points.shape[0]
+  if numberOfPoints < 2:
+    return numpy.zeros((numberOfPoints, 3))
+  tangents = numpy.empty_like(points)
+  tangents[1:-1] = points[2:] - points[:-2]
+  tangents[0] = points[1] - points[0]
+  tangents[-1] = points[-1] - points[-2]
+  norms = numpy.linalg.norm(tangents, axis = 1)
+  valid = norms > 0.0
+  tangents[valid] /= norms[valid, numpy.newaxis]
+  tangents[~valid] = 0.0
+  return tangents
+
+# Bounding box of the path, ordered as VTK bounds : xmin, xmax, ymin, ymax, zmin, zmax
+def pathBounds(points):
+  points = _asPoints(points)
+  bounds = numpy.zeros(6)
+  if points.shape[0] == 0:
+    return bounds
+  bounds[0::2] = points.min(axis = 0)
+  bounds[1::2] = points.max(axis = 0)
+  return bounds
+
+# Segment containing a distance from start of path, found by binary search : O(log n).
+# Returns the index of the segment's first point, and the fraction of the segment to reach the distance.
+# Distances may be a scalar or an array. They are clamped to the path length.
+def locateDistance(cumDistances, distance):
+  cumDistances = numpy.asarray(cumDistances)
+  distance = numpy.asarray(distance, dtype = numpy.float64)
+  if cumDistances.size < 2:
+    return numpy.zeros(distance.shape, dtype = int), numpy.zeros(distance.shape)
+  distance = numpy.clip(distance, 0.0, cumDistances[-1])
+  index = numpy.searchsorted(cumDistances, distance, side = "right") - 1
+  index = numpy.clip(index, 0, cumDistances.size - 2)
+  segmentLength = cumDistances[index + 1] - cumDistances[index]
+  # Coincident points make null segments
+  safeLength = numpy.where(segmentLength > 0.0, segmentLength, 1.0)
+  fraction = numpy.where(segmentLength > 0.0, (distance - cumDistances[index]) / safeLength, 0.0)
+  return index, fraction
+
+# Linear interpolation of per-point values at a distance from start of path.
+# Values may be scalars (radii) or vectors (points, tangents) : first dimension is the point index.
+def interpolateAtDistance(values, cumDistances, distance):
+  values = numpy.asarray(values)
+  if values.shape[0] == 0:
+    return numpy.zeros(0)
+  if values.shape[0] == 1:
+    return values[0].astype(numpy.float64)
+  index, fraction = locateDistance(cumDistances, distance)
+  if values.ndim > 1:
+    fraction = numpy.expand_dims(fraction, -1)
+  return values[index] * (1.0 - fraction) + values[index + 1] * fraction
+
+# Nearest position to a RAS point on the one or two segments joining a path point, usually the nearest point.
+# Returns the distance from start of path of that position, and its distance from the RAS point.
+def projectNearPoint(points, cumDistances, pointIndex, rasPoint):
+  points = _asPoints(points)
+  rasPoint = numpy.asarray(rasPoint, dtype = numpy.float64).reshape(3)
+  starts = numpy.arange(max(pointIndex - 1, 0), min(pointIndex + 1, points.shape[0] - 1))
+  if starts.size == 0:
+    return float(cumDistances[pointIndex]), float(numpy.linalg.norm(points[pointIndex] - rasPoint))
+  segments = points[starts + 1] - points[starts]
+  segmentLengths2 = numpy.einsum("ij,ij->i", segments, segments)
+  safeLengths2 = numpy.where(segmentLengths2 > 0.0, segmentLengths2, 1.0)
+  fractions = numpy.clip(numpy.einsum("ij,ij->i", rasPoint - points[starts], segments) / safeLengths2, 0.0, 1.0)
+  distances = numpy.linalg.norm(points[starts] + fractions[:, numpy.newaxis] * segments - rasPoint, axis = 1)
+  nearest = numpy.argmin(distances)
+  start = starts[nearest]
+  arcDistance = cumDistances[start] + fractions[nearest] * (cumDistances[start + 1] - cumDistances[start])
+  return float(arcDistance), float(distances[nearest])
+
+# Chain of boxes covering the path : each covers tileLength mm of arc length, extended by overlap / 2
+# on both sides, and padded by radius around the path.
+# Returns the start and end distances of each tile, and the RAS bounds of each box (tiles x 6, VTK order).
+def pathTiles(points, cumDistances, radius, tileLength, overlap = 0.0):
+  points = _asPoints(points)
+  cumDistances = numpy.asarray(cumDistances, dtype = numpy.float64)
+  if points.shape[0] == 0:
+    return numpy.zeros(0), numpy.zeros(0), numpy.zeros((0, 6))
+  length = cumDistances[-1]
+  numberOfTiles = max(int(numpy.ceil(length / tileLength)), 1) if tileLength > 0.0 else 1
+  tileStarts = numpy.clip(numpy.arange(numberOfTiles) * tileLength - overlap / 2.0, 0.0, length)
+  tileEnds = numpy.clip((numpy.arange(numberOfTiles) + 1) * tileLength + overlap / 2.0, 0.0, length)
+  tileEnds[-1] = length
+  # Path points within each tile, plus the interpolated points at both ends
+  firstInside = numpy.searchsorted(cumDistances, tileStarts, side = "left")
+  lastInside = numpy.searchsorted(cumDistances, tileEnds, side = "right")
+  startPoints = interpolateAtDistance(points, cumDistances, tileStarts).reshape(-1, 3)
+  endPoints = interpolateAtDistance(points, cumDistances, tileEnds).reshape(-1, 3)
+  bounds = numpy.zeros((numberOfTiles, 6))
+  for tile in range(numberOfTiles):
+    tilePoints = numpy.concatenate((startPoints[tile:tile + 1], points[firstInside[tile]:lastInside[tile]], endPoints[tile:tile + 1]))
+    bounds[tile, 0::2] = tilePoints.min(axis = 0) - radius
+    bounds[tile, 1::2] = tilePoints.max(axis = 0) + radius
+  return tileStarts, tileEnds, bounds
+
+# Normalize rows of an N x 3 array in place. Null rows are left null.
+def _normalizeRows(vectors):
+  norms = numpy.linalg.norm(vectors, axis = -1)
+  valid = norms > 1e-12
+  vectors[valid] /= norms[valid, numpy.newaxis]
+  vectors[~valid] = 0.0
+  return valid
+
+# Unit tangents averaged over 2 * halfWidth + 1 points.
+# The raw direction between two points is noisy on hand-drawn curves and dense centerlines.
+# Null tangents, from coincident points, take the value of the previous valid one.
+def smoothTangents(points, halfWidth = 2):
+  tangents = unitTangents(points)
+  numberOfPoints = tangents.shape[0]
+  if numberOfPoints == 0:
+    return tangents
+  if halfWidth > 0 and numberOfPoints > 2:
+    # Moving sum with cumsum, the window shrinks at both ends
+    padded = numpy.zeros((numberOfPoints + 1, 3))
+    numpy.cumsum(tangents, axis = 0, out = padded[1:])
+    indices = numpy.arange(numberOfPoints)
+    lower = numpy.maximum(indices - halfWidth, 0)
+    upper = numpy.minimum(indices + halfWidth + 1, numberOfPoints)
+    tangents = padded[upper] - padded[lower]
+  valid = _normalizeRows(tangents)
+  if not valid.all():
+    if not valid.any():
+      tangents[:] = (0.0, 0.0, 1.0)
+      return tangents
+    lastValid = numpy.maximum.accumulate(numpy.where(valid, numpy.arange(numberOfPoints), 0))
+    # Leading null tangents take the first valid one
+    lastValid[:numpy.argmax(valid)] = numpy.argmax(valid)
+    tangents = tangents[lastValid]
+  return tangents
+
+# In-plane axis at each point, perpendicular to the unit tangent, parallel transported along the path.
+# Consecutive axes do not rotate around the tangent : the view does not spin along the path.
+# The transport is computed without a Python loop. A reference axis is projected on each plane,
+# the twist between the transported previous reference and the current one is measured,
+# and the accumulated twist is applied back to the reference axes.
+def parallelTransportAxes(tangents):
+  tangents = numpy.asarray(tangents, dtype = numpy.float64).reshape(-1, 3)
+  numberOfPoints = tangents.shape[0]
+  if numberOfPoints == 0:
+    return numpy.zeros((0, 3))
+  # Reference axes : R axis projected on the plane, A axis where the tangent is nearly along R
+  reference = numpy.zeros((numberOfPoints, 3))
+  alongR = numpy.abs(tangents[:, 0]) > 0.9
+  reference[~alongR, 0] = 1.0
+  reference[alongR, 1] = 1.0
+  reference -= numpy.sum(reference * tangents, axis = 1)[:, numpy.newaxis] * tangents
+  _normalizeRows(reference)
+  if numberOfPoints == 1:
+    return reference
+  # Minimal rotation from previous to current tangent (Rodrigues), applied to previous reference
+  previousTangents = tangents[:-1]
+  currentTangents = tangents[1:]
+  previousReference = reference[:-1]
+  rotationAxes = numpy.cross(previousTangents, currentTangents)
+  cosines = numpy.sum(previousTangents * currentTangents, axis = 1)
+  # A reversed tangent has no defined minimal rotation : no transport there
+  rotatable = cosines > -1.0 + 1e-9
+  factors = numpy.zeros_like(cosines)
+  factors[rotatable] = 1.0 / (1.0 + cosines[rotatable])
+  transported = (previousReference * cosines[:, numpy.newaxis]
+    + numpy.cross(rotationAxes, previousReference)
+    + rotationAxes * (numpy.sum(rotationAxes * previousReference, axis = 1) * factors)[:, numpy.newaxis])
+  transported[~rotatable] = previousReference[~rotatable]
+  # Signed twist from the current reference to the transported one, around the current tangent
+  twists = numpy.zeros(numberOfPoints)
+  numpy.cumsum(signedAngles(reference[1:], transported, currentTangents), out = twists[1:])
+  return rotateAroundAxes(reference, tangents, twists)
+
+# Signed angle from vectors to other vectors, around unit axes they are perpendicular to
+def signedAngles(fromVectors, toVectors, axes):
+  sines = numpy.sum(numpy.cross(fromVectors, toVectors) * axes, axis = -1)
+  cosines = numpy.sum(fromVectors * toVectors, axis = -1)
+  return numpy.arctan2(sines, cosines)
+
+# Parallel transported axes along normals, the first axis being imposed.
+# Rotating all axes around their normals by the same angle keeps them parallel transported.
+def continueTransport(normals, startAxis):
+  axes = parallelTransportAxes(normals)
+  if axes.shape[0] == 0:
+    return axes
+  return rotateAroundAxes(axes, normals, signedAngles(axes[0], startAxis, normals[0]))
+
+# Rotate each vector around the unit axis of the same row, vectors being perpendicular to their axis
+def rotateAroundAxes(vectors, axes, angles):
+  angles = numpy.asarray(angles)[..., numpy.newaxis]
+  return vectors * numpy.cos(angles) + numpy.cross(axes, vectors) * numpy.sin(angles)
+
+# Slice frame at each point : unit normal (smoothed tangent) and transported in-plane axis
+def computeFrames(points, halfWidth = 2):
+  normals = smoothTangents(points, halfWidth)
+  axes = parallelTransportAxes(normals)
+  return normals, axes
+
+# Frames at distances from start of path, interpolated between points.
+# The interpolated axis is made perpendicular to the interpolated normal again.
+def interpolateFrames(origins, normals, axes, cumDistances, distances):
+  origin = interpolateAtDistance(origins, cumDistances, distances)
+  normal = interpolateAtDistance(normals, cumDistances, distances)
+  axis = interpolateAtDistance(axes, cumDistances, distances)
+  normal /= numpy.maximum(numpy.linalg.norm(normal, axis = -1), 1e-12)[..., numpy.newaxis]
+  axis -= numpy.sum(axis * normal, axis = -1)[..., numpy.newaxis] * normal
+  axis /= numpy.maximum(numpy.linalg.norm(axis, axis = -1), 1e-12)[..., numpy.newaxis]
+  return origin, normal, axis
+
+# SliceToRAS matrices of frames : columns are the in-plane axis, the second in-plane axis, the normal and the origin
+def frameMatrices(origins, normals, axes):
+  origins = numpy.asarray(origins, dtype = numpy.float64)
+  shape = origins.shape[:-1]
+  matrices = numpy.zeros(shape + (4, 4))
+  matrices[..., :3, 0] = axes
+  matrices[..., :3, 1] = numpy.cross(normals, axes)
+  matrices[..., :3, 2] = normals
+  matrices[..., :3, 3] = origins
+  matrices[..., 3, 3] = 1.0
+  return matrices
+
+# Range of points that differ between two arrays, found by comparing leading and trailing points.
+# Returns start, end in the old array and end in the new array : old[start:oldEnd] became new[start:newEnd].
+# start is None if both arrays are equal.
+def changedRange(oldPoints, newPoints, tolerance = 0.0):
+  oldPoints = _asPoints(oldPoints)
+  newPoints = _asPoints(newPoints)
+  oldCount = oldPoints.shape[0]
+  newCount = newPoints.shape[0]
+  commonCount = min(oldCount, newCount)
+  different = numpy.any(numpy.abs(oldPoints[:commonCount] - newPoints[:commonCount]) > tolerance, axis = 1)
+  start = int(numpy.argmax(different)) if different.any() else commonCount
+  if start == commonCount and oldCount == newCount:
+    return None, oldCount, newCount
+  # Trailing equal points, not overlapping the leading ones
+  tailCount = commonCount - start
+  different = numpy.any(numpy.abs(oldPoints[oldCount - tailCount:][::-1] - newPoints[newCount - tailCount:][::-1]) > tolerance, axis = 1)
+  suffix = int(numpy.argmax(different)) if different.any() else tailCount
+  return start, oldCount - suffix, newCount - suffix
+
+# Range of curve points to replace after control points [start:oldEnd] became [start:newEnd] (see changedRange).
+# Curve indices give the curve point of each control point. The curve points reached by an interpolating
+# spline extend beyond the changed control points : the range grows by a margin of control points, doubled
+# until the curve points just outside of it are unchanged within tolerance.
+# Returns (curveStart, oldStop, newStop) : oldCurve[curveStart:oldStop] is replaced by newCurve[curveStart:newStop].
+# Returns None if the curves do not fit a splice, when the whole curve must be recomputed.
+def curveSpliceRange(oldCurve, newCurve, oldCurveIndices, newCurveIndices, start, newEnd, tolerance = 0.0, margin = 2):
+  oldControlCount = len(oldCurveIndices)
+  newControlCount = len(newCurveIndices)
+  oldCount = oldCurve.shape[0]
+  newCount = newCurve.shape[0]
+  while True:
+    low = max(start - margin, 0)
+    newHigh = min(newEnd - 1 + margin, newControlCount - 1)
+    # Control points after the changed ones are the same, shifted by the change of count
+    oldHigh = newHigh - newControlCount + oldControlCount
+    reachesEnd = newHigh >= newControlCount - 1
+    curveStart = newCurveIndices[low] if low > 0 else 0
+    newStop = newCurveIndices[newHigh] + 1 if not reachesEnd else newCount
+    oldStop = oldCurveIndices[oldHigh] + 1 if not reachesEnd else oldCount
+    # Both curves must have the same number of points after the range
+    if oldHigh < 0 or newCount - newStop != oldCount - oldStop or curveStart > newStop or curveStart > oldStop:
+      return None
+    unchanged = True
+    if low > 0:
+      before = newCurveIndices[low - 1]
+      unchanged = numpy.all(numpy.abs(newCurve[before:curveStart] - oldCurve[before:curveStart]) <= tolerance)
+    if unchanged and not reachesEnd:
+      after = newCurveIndices[newHigh + 1] + 1 - newStop
+      unchanged = numpy.all(numpy.abs(newCurve[newStop:newStop + after] - oldCurve[oldStop:oldStop + after]) <= tolerance)
+    if unchanged or (low == 0 and reachesEnd):
+      return curveStart, oldStop, newStop
+    margin *= 2
+
+# Replace points[start:end] by newPoints, and patch the derived arrays instead of recomputing them.
+# Distances are recomputed over the changed segments and shifted downstream.
+# Frames are recomputed where the smoothing window sees a changed point, and downstream axes
+# are rotated by the change of twist, which keeps them parallel transported.
+# Arrays are modified in place if the number of points does not change. All arrays are returned.
+def splicePath(points, cumDistances, normals, axes, bounds, start, end, newPoints, halfWidth = 2):
+  newPoints = _asPoints(newPoints)
+  oldRangePoints = numpy.array(points[start:end], dtype = numpy.float64).reshape(-1, 3)
+  count = newPoints.shape[0]
+  if count == end - start:
+    points[start:end] = newPoints
+  else:
+    points = numpy.concatenate((points[:start], newPoints.astype(points.dtype), points[end:]))
+    cumDistances = numpy.concatenate((cumDistances[:start], numpy.zeros(count), cumDistances[end:]))
+    normals = numpy.concatenate((normals[:start], numpy.zeros((count, 3)), normals[end:]))
+    axes = numpy.concatenate((axes[:start], numpy.zeros((count, 3)), axes[end:]))
+  stop = start + count
+  numberOfPoints = points.shape[0]
+  if numberOfPoints == 0:
+    return points, cumDistances, normals, axes, numpy.zeros(6)
+
+  # Distances, from the last unchanged point before the range to the first one after it
+  first = max(start - 1, 0)
+  last = min(stop, numberOfPoints - 1)
+  base = cumDistances[first] if start > 0 else 0.0
+  previousLastDistance = cumDistances[last]
+  relativeDistances = cumulativeDistances(points[first:last + 1])
+  cumDistances[first:last + 1] = base + relativeDistances
+  if stop < numberOfPoints:
+    cumDistances[last + 1:] += base + relativeDistances[-1] - previousLastDistance
+
+  # Bounds grow with the new points. They may shrink only if an old point was on the boundary.
+  if oldRangePoints.shape[0] > 0 and (numpy.any(oldRangePoints.min(axis = 0) <= bounds[0::2])
+      or numpy.any(oldRangePoints.max(axis = 0) >= bounds[1::2])):
+    bounds = pathBounds(points)
+  elif count > 0:
+    bounds = numpy.array(bounds, dtype = numpy.float64)
+    bounds[0::2] = numpy.minimum(bounds[0::2], newPoints.min(axis = 0))
+    bounds[1::2] = numpy.maximum(bounds[1::2], newPoints.max(axis = 0))
+
+  # Normals seeing a changed point, computed with enough context on both sides
+  low = max(start - halfWidth - 1, 0)
+  high = min(stop + halfWidth + 1, numberOfPoints)
+  windowLow = max(low - halfWidth - 1, 0)
+  windowHigh = min(high + halfWidth + 1, numberOfPoints)
+  normals[low:high] = smoothTangents(points[windowLow:windowHigh], halfWidth)[low - windowLow:high - windowLow]
+
+  # Axes transported from the last unchanged frame, including the first unchanged point after the range
+  segmentEnd = min(high + 1, numberOfPoints)
+  if low > 0:
+    transportedAxes = continueTransport(normals[low - 1:segmentEnd], axes[low - 1])[1:]
+  else:
+    transportedAxes = parallelTransportAxes(normals[:segmentEnd])
+  if high < numberOfPoints:
+    twist = signedAngles(axes[high], transportedAxes[-1], normals[high])
+    axes[low:high] = transportedAxes[:-1]
+    axes[high:] = rotateAroundAxes(axes[high:], normals[high:], twist)
+  else:
+    axes[low:high] = transportedAxes
+  return points, cumDistances, normals, axes, bounds
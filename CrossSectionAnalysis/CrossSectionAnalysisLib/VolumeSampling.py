@@ -0,0 +1,130 @@
+import numpy
+
+#
+# VolumeSampling
+# Sampling of a voxel array on cross-sections of a path.
+# Voxel arrays are indexed [k, j, i], as returned by slicer.util.arrayFromVolume.
+# Nothing here requires Slicer, and the voxel array is never copied.
+#
+
+__all__ = [
+  "gridSize",
+  "crossSectionGrid",
+  "transformPoints",
+  "sampleVolume",
+  "diskMask",
+  "diskOffsets",
+  "crossSectionStatistics",
+  "volumeTiles",
+  ]
+
+# Number of pixels along each side of a square cross-section
+def gridSize(fieldOfView, pixelSpacing):
+  return max(1, int(round(fieldOfView / pixelSpacing)))
+
+# In-plane offsets of a square grid centered on the origin
+def _gridOffsets(fieldOfView, pixelSpacing):
+  numberOfPixels = gridSize(fieldOfView, pixelSpacing)
+  return (numpy.arange(numberOfPixels) - (numberOfPixels - 1) / 2.0) * pixelSpacing
+
+# RAS points of a square grid on each frame : shape (frames, rows, columns, 3).
+# Columns go along the frame's in-plane axis, rows along the second in-plane axis (normal x axis).
+def crossSectionGrid(origins, normals, axes, fieldOfView, pixelSpacing):
+  origins = numpy.asarray(origins, dtype = numpy.float64).reshape(-1, 3)
+  normals = numpy.asarray(normals, dtype = numpy.float64).reshape(-1, 3)
+  axes = numpy.asarray(axes, dtype = numpy.float64).reshape(-1, 3)
+  secondAxes = numpy.cross(normals, axes)
+  offsets = _gridOffsets(fieldOfView, pixelSpacing)
+  return (origins[:, numpy.newaxis, numpy.newaxis, :]
+    + offsets[numpy.newaxis, numpy.newaxis, :, numpy.newaxis] * axes[:, numpy.newaxis, numpy.newaxis, :]
+    + offsets[numpy.newaxis, :, numpy.newaxis, numpy.newaxis] * secondAxes[:, numpy.newaxis, numpy.newaxis, :])
+
+# Apply a 4 x 4 homogeneous matrix to points of shape (..., 3)
+def transformPoints(matrix, points):
+  matrix = numpy.asarray(matrix, dtype = numpy.float64)
+  return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+# Trilinear interpolation of voxels at RAS points of shape (..., 3).
+# Points outside the volume get outsideValue. Only the 8 neighbours of each point are read.
+def sampleVolume(voxels, rasToIJK, rasPoints, outsideValue = 0.0):
+  ijk = transformPoints(rasToIJK, rasPoints)
+  shape = ijk.shape[:-1]
+  ijk = ijk.reshape(-1, 3)
+  # Voxel arrays are [k, j, i]
+  dimensions = numpy.array(voxels.shape[::-1])
+  inside = numpy.all((ijk >= 0.0) & (ijk <= dimensions - 1), axis = 1)
+  lower = numpy.floor(ijk).astype(numpy.intp)
+  lower = numpy.clip(lower, 0, numpy.maximum(dimensions - 2, 0))
+  fractions = numpy.clip(ijk - lower, 0.0, 1.0)
+  upper = numpy.minimum(lower + 1, dimensions - 1)
+  values = numpy.zeros(ijk.shape[0])
+  for corner in range(8):
+    ci = upper[:, 0] if corner & 1 else lower[:, 0]
+    cj = upper[:, 1] if corner & 2 else lower[:, 1]
+    ck = upper[:, 2] if corner & 4 else lower[:, 2]
+    weights = ((fractions[:, 0] if corner & 1 else 1.0 - fractions[:, 0])
+      * (fractions[:, 1] if corner & 2 else 1.0 - fractions[:, 1])
+      * (fractions[:, 2] if corner & 4 else 1.0 - fractions[:, 2]))
+    values += weights * voxels[ck, cj, ci]
+  values[~inside] = outsideValue
+  return values.reshape(shape)
+
+# Pixels within a radius, on a square grid of side 2 * radius
+def diskMask(radius, pixelSpacing):
+  offsets = _gridOffsets(2.0 * radius, pixelSpacing)
+  u, v = numpy.meshgrid(offsets, offsets)
+  return u * u + v * v <= radius * radius
+
+# In-plane offsets, along the two in-plane axes, of the grid pixels within a radius
+def diskOffsets(radius, pixelSpacing):
+  offsets = _gridOffsets(2.0 * radius, pixelSpacing)
+  u, v = numpy.meshgrid(offsets, offsets)
+  inside = diskMask(radius, pixelSpacing)
+  if not inside.any():
+    return numpy.zeros((1, 2))
+  return numpy.stack((u[inside], v[inside]), axis = 1)
+
+# Intensity statistics within a radius, and lumen area above a threshold, on the cross-section of each frame.
+# All frames of a chunk are sampled in one call ; chunks only bound the memory used.
+# Returns arrays of mean, maximum, minimum and lumen area, one value per frame.
+def crossSectionStatistics(voxels, rasToIJK, origins, normals, axes, radius, pixelSpacing, threshold, framesPerChunk = 256):
+  origins = numpy.asarray(origins, dtype = numpy.float64).reshape(-1, 3)
+  normals = numpy.asarray(normals, dtype = numpy.float64).reshape(-1, 3)
+  axes = numpy.asarray(axes, dtype = numpy.float64).reshape(-1, 3)
+  secondAxes = numpy.cross(normals, axes)
+  offsets = diskOffsets(radius, pixelSpacing)
+  numberOfFrames = origins.shape[0]
+  means = numpy.zeros(numberOfFrames)
+  maxima = numpy.zeros(numberOfFrames)
+  minima = numpy.zeros(numberOfFrames)
+  lumenAreas = numpy.zeros(numberOfFrames)
+  pixelArea = pixelSpacing * pixelSpacing
+  for first in range(0, numberOfFrames, framesPerChunk):
+    last = min(first + framesPerChunk, numberOfFrames)
+    points = (origins[first:last, numpy.newaxis, :]
+      + offsets[numpy.newaxis, :, 0, numpy.newaxis] * axes[first:last, numpy.newaxis, :]
+      + offsets[numpy.newaxis, :, 1, numpy.newaxis] * secondAxes[first:last, numpy.newaxis, :])
+    values = sampleVolume(voxels, rasToIJK, points)
+    means[first:last] = values.mean(axis = 1)
+    maxima[first:last] = values.max(axis = 1)
+    minima[first:last] = values.min(axis = 1)
+    lumenAreas[first:last] = numpy.count_nonzero(values >= threshold, axis = 1) * pixelArea
+  return means, maxima, minima, lumenAreas
+
+# Voxel ranges of RAS boxes (VTK order bounds), as slices of the [k, j, i] voxel array.
+# A box is mapped by its 8 corners : with an oblique volume, the range covers the whole box.
+# Yields the tile index, the (k, j, i) slices and a view on the voxels : nothing is copied.
+# Boxes entirely outside of the volume are skipped.
+def volumeTiles(voxels, rasToIJK, tileBounds):
+  tileBounds = numpy.asarray(tileBounds, dtype = numpy.float64).reshape(-1, 6)
+  dimensions = numpy.array(voxels.shape[::-1])
+  cornerSelectors = numpy.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)])
+  for tile, bounds in enumerate(tileBounds):
+    corners = numpy.where(cornerSelectors == 0, bounds[0::2], bounds[1::2])
+    ijk = transformPoints(rasToIJK, corners)
+    low = numpy.maximum(numpy.floor(ijk.min(axis = 0)).astype(int), 0)
+    high = numpy.minimum(numpy.ceil(ijk.max(axis = 0)).astype(int) + 1, dimensions)
+    if numpy.any(high <= low):
+      continue
+    slices = (slice(low[2], high[2]), slice(low[1], high[1]), slice(low[0], high[0]))
+    yield tile, slices, voxels[slices]
@@ -0,0 +1,9 @@
+#
+# CrossSectionAnalysisLib
+# Computations that do not depend on Slicer.
+# They operate on plain numpy arrays and can be used and tested outside of the application.
+#
+
+from .PathGeometry import *
+from .VolumeSampling import *
+from .CrossSectionCache import *
@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy
+
+#
+# CrossSectionAnalysisBenchmark
+# Timings of the path pipeline on synthetic helical and tortuous vessel paths, from 10^2 to 10^6 points.
+#
+# The geometry kernel functions are timed with plain numpy, anywhere, under 'kernel.' names :
+#   python CrossSectionAnalysisBenchmark.py --output benchmark.json
+# In Slicer, the logic methods are timed too, under their own names, on a model node built from the same points :
+#   Slicer --no-main-window --python-script CrossSectionAnalysisBenchmark.py -- --output benchmark.json
+# Results of two versions are compared with :
+#   python CrossSectionAnalysisBenchmark.py --output new.json --compare old.json
+#
+
+# The module's directory, for CrossSectionAnalysisLib
+moduleDirectory = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+if moduleDirectory not in sys.path:
+  sys.path.insert(0, moduleDirectory)
+
+from CrossSectionAnalysisLib import PathGeometry
+
+#
+# Synthetic paths
+#
+
+# Helix of radius 10 mm, 10 turns : the same curve gets denser with more points
+def helicalPath(numberOfPoints):
+  t = numpy.linspace(0.0, 20.0 * numpy.pi, numberOfPoints)
+  return numpy.stack((10.0 * numpy.cos(t), 10.0 * numpy.sin(t), 2.0 * t), axis = 1)
+
+# Tortuous vessel of about 300 mm : a persistent random walk, always the same for a given size
+def tortuousPath(numberOfPoints):
+  generator = numpy.random.default_rng(numberOfPoints)
+  turns = numpy.cumsum(generator.normal(scale = 0.05, size = (numberOfPoints, 2)), axis = 0)
+  directions = numpy.stack((numpy.sin(turns[:, 0]) * numpy.cos(turns[:, 1]),
+    numpy.sin(turns[:, 0]) * numpy.sin(turns[:, 1]),
+    numpy.cos(turns[:, 0])), axis = 1)
+  return numpy.cumsum(directions * (300.0 / numberOfPoints), axis = 0)
+
+def syntheticRadii(points):
+  distances = PathGeometry.cumulativeDistances(points)
+  return 3.0 + numpy.sin(distances / 20.0)
+
+PATH_GENERATORS = {
+  "helical" : helicalPath,
+  "tortuous" : tortuousPath,
+  }
+
+#
+# Timing
+#
+
+# Best time of repeated calls : at least minimumRepeats, and more while under minimumTime
+def timeCall(function, minimumRepeats = 3, minimumTime = 0.2, maximumRepeats = 1000):
+  times = []
+  start = time.perf_counter()
+  while len(times) < maximumRepeats and (len(times) < minimumRepeats or time.perf_counter() - start < minimumTime):
+    callStart = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - callStart)
+  return min(times), len(times)
+
+# Positions visited by the slider tick benchmarks
+def tickPositions(numberOfPoints, count = 100):
+  return numpy.linspace(0, numberOfPoints - 1, count).astype(int)
+
+# Kernel functions, as plain numpy on the path array. They are named after the kernel functions
+# they time : the logic operations built on them are timed in Slicer only.
+def numpyOperations(points):
+  cumDistances = PathGeometry.cumulativeDistances(points)
+  normals, axes = PathGeometry.computeFrames(points)
+  length = cumDistances[-1]
+  indices = tickPositions(points.shape[0])
+  distances = numpy.linspace(0.0, length, indices.size)
+
+  def frameMatrices():
+    for index in indices:
+      PathGeometry.frameMatrices(points[index], normals[index], axes[index])
+
+  def interpolateFrames():
+    for distance in distances:
+      PathGeometry.interpolateFrames(points, normals, axes, cumDistances, distance)
+
+  def interpolateAtDistance():
+    for distance in distances:
+      PathGeometry.interpolateAtDistance(points, cumDistances, distance)
+
+  def locateDistance():
+    for distance in distances:
+      PathGeometry.locateDistance(cumDistances, distance)
+
+  return [
+    ("kernel.cumulativeDistances", lambda: PathGeometry.cumulativeDistances(points), 1),
+    ("kernel.pathBounds", lambda: PathGeometry.pathBounds(points), 1),
+    ("kernel.computeFrames", lambda: PathGeometry.computeFrames(points), 1),
+    ("kernel.frameMatrices", frameMatrices, indices.size),
+    ("kernel.interpolateFrames", interpolateFrames, distances.size),
+    ("kernel.interpolateAtDistance", interpolateAtDistance, distances.size),
+    ("kernel.locateDistance", locateDistance, distances.size),
+    ]
+
+# Model node of a VMTK-like centerline, with a 'Radius' point array
+def createCenterlineModel(points, radii):
+  import slicer
+  import vtk
+  from vtk.util.numpy_support import numpy_to_vtk
+  polyData = vtk.vtkPolyData()
+  vtkPoints = vtk.vtkPoints()
+  vtkPoints.SetData(numpy_to_vtk(numpy.ascontiguousarray(points), deep = True))
+  polyData.SetPoints(vtkPoints)
+  polyLine = vtk.vtkPolyLine()
+  polyLine.GetPointIds().SetNumberOfIds(points.shape[0])
+  for index in range(points.shape[0]):
+    polyLine.GetPointIds().SetId(index, index)
+  lines = vtk.vtkCellArray()
+  lines.InsertNextCell(polyLine)
+  polyData.SetLines(lines)
+  radiusArray = numpy_to_vtk(numpy.ascontiguousarray(radii), deep = True)
+  radiusArray.SetName("Radius")
+  polyData.GetPointData().AddArray(radiusArray)
+  return slicer.modules.models.logic().AddModel(polyData)
+
+# Logic operations on a model node, in Slicer
+def slicerOperations(points, radii):
+  import slicer
+  from CrossSectionAnalysis import CrossSectionAnalysisLogic
+  modelNode = createCenterlineModel(points, radii)
+  logic = CrossSectionAnalysisLogic()
+  logic.selectNode(modelNode)
+  indices = tickPositions(points.shape[0])
+
+  def fillPathArray():
+    # Invalidate the cached frame table : this measures a full recompute
+    logic.frameTableMTime = 0
+    logic.fillPathArray()
+
+  def process():
+    for index in indices:
+      logic.process(index)
+
+  def currentPosition():
+    for index in indices:
+      logic.currentPosition(index)
+
+  def calculateRelativeDistance():
+    for index in indices:
+      logic.calculateRelativeDistance(index)
+
+  # What the widget runs on each slider tick : reslice, then labels
+  def sliderTick():
+    for index in indices:
+      logic.process(index)
+      logic.currentPosition(index)
+      logic.pathLength()
+      logic.calculateRelativeDistance(index)
+      logic.currentRadius(index)
+      if logic.inputSliceNode is not None:
+        logic.getSliceOrientation()
+
+  operations = [
+    ("cumulateDistances", logic.cumulateDistances, 1),
+    ("fillPathArray", fillPathArray, 1),
+    ("process", process, indices.size),
+    ("currentPosition", currentPosition, indices.size),
+    ("calculateRelativeDistance", calculateRelativeDistance, indices.size),
+    ("sliderTick", sliderTick, indices.size),
+    ]
+  return operations, lambda: slicer.mrmlScene.RemoveNode(modelNode)
+
+def inSlicer():
+  try:
+    import slicer
+    return slicer.mrmlScene is not None
+  except (ImportError, AttributeError):
+    return False
+
+def runBenchmark(sizes, pathNames, useSlicer):
+  results = []
+  for pathName in pathNames:
+    for numberOfPoints in sizes:
+      points = PATH_GENERATORS[pathName](numberOfPoints)
+      modes = [("numpy", numpyOperations(points), None)]
+      if useSlicer:
+        operations, cleanup = slicerOperations(points, syntheticRadii(points))
+        modes.append(("slicer", operations, cleanup))
+      for mode, operations, cleanup in modes:
+        for operationName, function, callsPerRun in operations:
+          seconds, repeats = timeCall(function)
+          results.append({
+            "path" : pathName,
+            "points" : numberOfPoints,
+            "mode" : mode,
+            "operation" : operationName,
+            # Time of one call : operations looping over slider positions are divided by their number
+            "seconds" : seconds / callsPerRun,
+            "repeats" : repeats,
+            })
+          print("%-9s %8d %-6s %-30s %12.3f us" % (pathName, numberOfPoints, mode, operationName, seconds / callsPerRun * 1e6))
+        if cleanup is not None:
+          cleanup()
+  return results
+
+# Ratio of new to old times for the entries present in both result files
+def compareResults(newResults, oldResults, tolerance):
+  key = lambda result: (result["path"], result["points"], result["mode"], result["operation"])
+  oldTimes = {key(result) : result["seconds"] for result in oldResults}
+  regressions = []
+  for result in newResults:
+    oldSeconds = oldTimes.get(key(result))
+    if oldSeconds is None or oldSeconds <= 0.0:
+      continue
+    ratio = result["seconds"] / oldSeconds
+    if ratio > 1.0 + tolerance:
+      regressions.append((key(result), ratio))
+      print("Regression: %s %d %s %s is %.2f times slower" % (key(result) + (ratio,)))
+  return regressions
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = "Benchmark of the CrossSectionAnalysis path pipeline.")
+  parser.add_argument("--output", default = "benchmark.json", help = "JSON result file")
+  parser.add_argument("--max-points", type = int, default = 1000000, help = "Largest path size, sizes are powers of 10 from 100")
+  parser.add_argument("--paths", nargs = "+", default = sorted(PATH_GENERATORS.keys()), choices = sorted(PATH_GENERATORS.keys()))
+  parser.add_argument("--numpy-only", action = "store_true", help = "Do not time the logic in Slicer")
+  parser.add_argument("--compare", default = None, help = "Previous JSON result file to compare with")
+  parser.add_argument("--tolerance", type = float, default = 0.2, help = "Slowdown ratio above 1 reported as a regression")
+  arguments = parser.parse_args(argv)
+  sizes = [10 ** exponent for exponent in range(2, 7) if 10 ** exponent <= arguments.max_points]
+  results = runBenchmark(sizes, arguments.paths, inSlicer() and not arguments.numpy_only)
+  report = {
+    "python" : platform.python_version(),
+    "numpy" : numpy.__version__,
+    "platform" : platform.platform(),
+    "time" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "results" : results,
+    }
+  with open(arguments.output, "w") as outputFile:
+    json.dump(report, outputFile, indent = 1)
+  if arguments.compare is not None:
+    with open(arguments.compare) as previousFile:
+      if compareResults(results, json.load(previousFile)["results"], arguments.tolerance):
+        return 1
+  return 0
+
+if __name__ == "__main__":
+  exitCode = main()
+  if "slicer" in sys.modules:
+    import slicer
+    slicer.util.exit(exitCode)
+  else:
+    sys.exit(exitCode)
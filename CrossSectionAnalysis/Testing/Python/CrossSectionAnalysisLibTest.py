@@ -0,0 +1,816 @@
+import csv
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import numpy
+
+#
+# CrossSectionAnalysisLibTest
+# Tests of the computations that do not depend on Slicer. They run with plain Python :
+#   python -m pytest CrossSectionAnalysisLibTest.py
+# and, in the Slicer build tree, as a ctest.
+#
+
+# The module's directory, for CrossSectionAnalysisLib
+moduleDirectory = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+if moduleDirectory not in sys.path:
+  sys.path.insert(0, moduleDirectory)
+
+from CrossSectionAnalysisLib import PathGeometry, VolumeSampling, CrossSectionCache, Instrumentation, BranchGraph, PathBatch, PathDataCache
+
+# Helix of radius 10 mm
+def helicalPath(numberOfPoints, turns = 3.0):
+  t = numpy.linspace(0.0, 2.0 * numpy.pi * turns, numberOfPoints)
+  return numpy.stack((10.0 * numpy.cos(t), 10.0 * numpy.sin(t), 2.0 * t), axis = 1)
+
+# Persistent random walk, always the same for a given seed
+def tortuousPath(numberOfPoints, seed = 0):
+  generator = numpy.random.default_rng(seed)
+  turns = numpy.cumsum(generator.normal(scale = 0.1, size = (numberOfPoints, 2)), axis = 0)
+  directions = numpy.stack((numpy.sin(turns[:, 0]) * numpy.cos(turns[:, 1]),
+    numpy.sin(turns[:, 0]) * numpy.sin(turns[:, 1]),
+    numpy.cos(turns[:, 0])), axis = 1)
+  return numpy.cumsum(directions, axis = 0)
+
+# The per-point loop the module used before the kernel
+def loopCumulativeDistances(points):
+  cumDistances = numpy.zeros(points.shape[0])
+  previous = points[0]
+  dist = 0
+  for i, point in enumerate(points):
+    dist += numpy.linalg.norm(point - previous)
+    cumDistances[i] = dist
+    previous = point
+  return cumDistances
+
+# Sequential parallel transport : each axis is the previous one, rotated by the minimal rotation
+# from the previous normal to the current one
+def loopTransportedAxes(normals, startAxis):
+  axes = numpy.zeros_like(normals)
+  axes[0] = startAxis
+  for i in range(1, normals.shape[0]):
+    rotationAxis = numpy.cross(normals[i - 1], normals[i])
+    cosine = normals[i - 1].dot(normals[i])
+    axis = axes[i - 1]
+    axes[i] = axis * cosine + numpy.cross(rotationAxis, axis) + rotationAxis * rotationAxis.dot(axis) / (1.0 + cosine)
+  return axes
+
+class PathGeometryDistanceTest(unittest.TestCase):
+
+  def test_cumulativeDistancesMatchesLoop(self):
+    for points in (helicalPath(500), tortuousPath(500), numpy.array([[1.0, 2.0, 3.0]])):
+      numpy.testing.assert_allclose(PathGeometry.cumulativeDistances(points), loopCumulativeDistances(points), atol = 1e-9)
+
+  def test_cumulativeDistancesOfEmptyPath(self):
+    self.assertEqual(PathGeometry.cumulativeDistances(numpy.zeros((0, 3))).size, 0)
+
+  def test_locateDistanceClamps(self):
+    points = numpy.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [3.0, 0.0, 0.0]])
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    index, fraction = PathGeometry.locateDistance(cumDistances, numpy.array([-5.0, 0.0, 2.0, 3.0, 10.0]))
+    numpy.testing.assert_array_equal(index, [0, 0, 1, 1, 1])
+    numpy.testing.assert_allclose(fraction, [0.0, 0.0, 0.5, 1.0, 1.0])
+
+  def test_locateDistanceOnZeroLengthSegments(self):
+    points = numpy.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 0.0, 0.0], [2.0, 0.0, 0.0]])
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    distances = numpy.array([0.5, 1.0, 1.5])
+    index, fraction = PathGeometry.locateDistance(cumDistances, distances)
+    self.assertTrue(numpy.all(numpy.isfinite(fraction)))
+    numpy.testing.assert_allclose(cumDistances[index] + fraction * (cumDistances[index + 1] - cumDistances[index]), distances)
+    numpy.testing.assert_allclose(PathGeometry.interpolateAtDistance(points, cumDistances, distances)[:, 0], distances)
+
+  def test_locateDistanceOnShortPaths(self):
+    index, fraction = PathGeometry.locateDistance(numpy.zeros(1), 3.0)
+    self.assertEqual(int(index), 0)
+    self.assertEqual(float(fraction), 0.0)
+
+# Nearest position on all segments of a path, one segment at a time
+def bruteForceProjection(points, cumDistances, rasPoint):
+  bestOffset, bestDistance = numpy.inf, None
+  for i in range(points.shape[0] - 1):
+    segment = points[i + 1] - points[i]
+    length2 = segment.dot(segment)
+    fraction = min(max((rasPoint - points[i]).dot(segment) / length2, 0.0), 1.0) if length2 > 0.0 else 0.0
+    offset = numpy.linalg.norm(points[i] + fraction * segment - rasPoint)
+    if offset < bestOffset:
+      bestOffset, bestDistance = offset, cumDistances[i] + fraction * (cumDistances[i + 1] - cumDistances[i])
+  return bestDistance, bestOffset
+
+class PathGeometryProjectionTest(unittest.TestCase):
+
+  # The nearest point is found by a point locator in the module : here, by brute force
+  def project(self, points, cumDistances, rasPoint):
+    pointIndex = int(numpy.argmin(numpy.linalg.norm(points - rasPoint, axis = 1)))
+    return PathGeometry.projectNearPoint(points, cumDistances, pointIndex, rasPoint)
+
+  def test_projectionMatchesAllSegments(self):
+    generator = numpy.random.default_rng(1)
+    for points in (helicalPath(300), tortuousPath(300)):
+      cumDistances = PathGeometry.cumulativeDistances(points)
+      # Near the path, as when the crosshair is set on a vessel
+      for rasPoint in points[generator.integers(0, points.shape[0], 100)] + generator.normal(scale = 0.2, size = (100, 3)):
+        distance, offset = self.project(points, cumDistances, rasPoint)
+        expectedDistance, expectedOffset = bruteForceProjection(points, cumDistances, rasPoint)
+        self.assertAlmostEqual(offset, expectedOffset, places = 9)
+        self.assertAlmostEqual(distance, expectedDistance, places = 9)
+
+  def test_projectionClampsAtEnds(self):
+    points = helicalPath(100)
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    before = points[0] - 3.0 * (points[1] - points[0]) / numpy.linalg.norm(points[1] - points[0])
+    distance, offset = self.project(points, cumDistances, before)
+    self.assertEqual(distance, 0.0)
+    self.assertAlmostEqual(offset, 3.0)
+    after = points[-1] + 2.0 * (points[-1] - points[-2]) / numpy.linalg.norm(points[-1] - points[-2])
+    distance, offset = self.project(points, cumDistances, after)
+    self.assertAlmostEqual(distance, cumDistances[-1])
+    self.assertAlmostEqual(offset, 2.0)
+    for rasPoint in (before, after):
+      numpy.testing.assert_allclose(self.project(points, cumDistances, rasPoint), bruteForceProjection(points, cumDistances, rasPoint))
+
+  def test_projectionOnShortPaths(self):
+    points = numpy.array([[1.0, 2.0, 3.0]])
+    self.assertEqual(PathGeometry.projectNearPoint(points, numpy.zeros(1), 0, [1.0, 2.0, 7.0]), (0.0, 4.0))
+    # Coincident points : zero-length segments
+    points = numpy.array([[0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [2.0, 0.0, 0.0]])
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    distance, offset = PathGeometry.projectNearPoint(points, cumDistances, 1, [0.5, 1.0, 0.0])
+    self.assertAlmostEqual(distance, 0.5)
+    self.assertAlmostEqual(offset, 1.0)
+
+class PathGeometryFrameTest(unittest.TestCase):
+
+  def test_axesArePerpendicularUnitVectors(self):
+    for points in (helicalPath(400), tortuousPath(400)):
+      normals, axes = PathGeometry.computeFrames(points)
+      numpy.testing.assert_allclose(numpy.linalg.norm(normals, axis = 1), 1.0, atol = 1e-12)
+      numpy.testing.assert_allclose(numpy.linalg.norm(axes, axis = 1), 1.0, atol = 1e-12)
+      numpy.testing.assert_allclose(numpy.sum(normals * axes, axis = 1), 0.0, atol = 1e-12)
+
+  def test_axesAreParallelTransported(self):
+    for points in (helicalPath(400), tortuousPath(400)):
+      normals, axes = PathGeometry.computeFrames(points)
+      numpy.testing.assert_allclose(axes, loopTransportedAxes(normals, axes[0]), atol = 1e-9)
+
+  def test_straightPathHasConstantAxis(self):
+    points = numpy.stack((numpy.zeros(50), numpy.linspace(0.0, 49.0, 50), numpy.zeros(50)), axis = 1)
+    normals, axes = PathGeometry.computeFrames(points)
+    numpy.testing.assert_allclose(axes, numpy.tile(axes[0], (50, 1)), atol = 1e-12)
+
+  def test_frameMatricesAreRotations(self):
+    points = tortuousPath(100)
+    normals, axes = PathGeometry.computeFrames(points)
+    matrices = PathGeometry.frameMatrices(points, normals, axes)
+    rotations = matrices[:, :3, :3]
+    numpy.testing.assert_allclose(numpy.linalg.det(rotations), 1.0, atol = 1e-9)
+    numpy.testing.assert_allclose(rotations[:, :, 2], normals, atol = 1e-12)
+    numpy.testing.assert_allclose(matrices[:, :3, 3], points, atol = 1e-12)
+
+  def test_interpolatedFramesAtPoints(self):
+    points = tortuousPath(100)
+    normals, axes = PathGeometry.computeFrames(points)
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    origin, normal, axis = PathGeometry.interpolateFrames(points, normals, axes, cumDistances, cumDistances)
+    numpy.testing.assert_allclose(origin, points, atol = 1e-9)
+    numpy.testing.assert_allclose(normal, normals, atol = 1e-9)
+    numpy.testing.assert_allclose(axis, axes, atol = 1e-9)
+
+  def test_interpolatedFramesBetweenPoints(self):
+    points = helicalPath(200)
+    normals, axes = PathGeometry.computeFrames(points)
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    middles = (cumDistances[:-1] + cumDistances[1:]) / 2.0
+    origin, normal, axis = PathGeometry.interpolateFrames(points, normals, axes, cumDistances, middles)
+    numpy.testing.assert_allclose(origin, (points[:-1] + points[1:]) / 2.0, atol = 1e-9)
+    numpy.testing.assert_allclose(numpy.linalg.norm(normal, axis = 1), 1.0, atol = 1e-12)
+    numpy.testing.assert_allclose(numpy.linalg.norm(axis, axis = 1), 1.0, atol = 1e-12)
+    numpy.testing.assert_allclose(numpy.sum(normal * axis, axis = 1), 0.0, atol = 1e-12)
+    # Between the frames of the segment's points
+    for frames, pointFrames in ((normal, normals), (axis, axes)):
+      self.assertTrue(numpy.all(numpy.sum(frames * pointFrames[:-1], axis = 1) >= numpy.sum(pointFrames[:-1] * pointFrames[1:], axis = 1) - 1e-9))
+      self.assertTrue(numpy.all(numpy.sum(frames * pointFrames[1:], axis = 1) >= numpy.sum(pointFrames[:-1] * pointFrames[1:], axis = 1) - 1e-9))
+
+  # Frames just before and just after a point tend to the point's frame
+  def test_interpolatedFramesAreContinuous(self):
+    points = tortuousPath(100)
+    normals, axes = PathGeometry.computeFrames(points)
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    for epsilon in (-1e-6, 1e-6):
+      origin, normal, axis = PathGeometry.interpolateFrames(points, normals, axes, cumDistances, cumDistances[1:-1] + epsilon)
+      numpy.testing.assert_allclose(origin, points[1:-1], atol = 1e-5)
+      numpy.testing.assert_allclose(normal, normals[1:-1], atol = 1e-5)
+      numpy.testing.assert_allclose(axis, axes[1:-1], atol = 1e-5)
+
+  def test_interpolatedFramesClamp(self):
+    points = helicalPath(50)
+    normals, axes = PathGeometry.computeFrames(points)
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    origin, normal, axis = PathGeometry.interpolateFrames(points, normals, axes, cumDistances,
+      numpy.array([-5.0, cumDistances[-1] + 5.0]))
+    numpy.testing.assert_allclose(origin, points[[0, -1]], atol = 1e-12)
+    numpy.testing.assert_allclose(normal, normals[[0, -1]], atol = 1e-12)
+    numpy.testing.assert_allclose(axis, axes[[0, -1]], atol = 1e-12)
+    # A scalar distance gives a single frame, as for the slider
+    origin, normal, axis = PathGeometry.interpolateFrames(points, normals, axes, cumDistances, cumDistances[-1] * 2.0)
+    self.assertEqual(origin.shape, (3,))
+    numpy.testing.assert_allclose(normal, normals[-1], atol = 1e-12)
+
+class PathGeometryTileTest(unittest.TestCase):
+
+  def test_tilesOfStraightPath(self):
+    points = numpy.stack((numpy.arange(11.0), numpy.zeros(11), numpy.zeros(11)), axis = 1)
+    tileStarts, tileEnds, bounds = PathGeometry.pathTiles(points, PathGeometry.cumulativeDistances(points), 1.0, 4.0)
+    numpy.testing.assert_allclose(tileStarts, [0.0, 4.0, 8.0])
+    numpy.testing.assert_allclose(tileEnds, [4.0, 8.0, 10.0])
+    numpy.testing.assert_allclose(bounds, [[-1.0, 5.0, -1.0, 1.0, -1.0, 1.0],
+      [3.0, 9.0, -1.0, 1.0, -1.0, 1.0], [7.0, 11.0, -1.0, 1.0, -1.0, 1.0]])
+
+  # Bounds are those of the path between the tile's ends, interpolated ends included, padded by the radius
+  def test_tileBoundsCoverPath(self):
+    points = helicalPath(300)
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    radius = 2.5
+    tileStarts, tileEnds, bounds = PathGeometry.pathTiles(points, cumDistances, radius, 15.0)
+    for tileStart, tileEnd, tileBounds in zip(tileStarts, tileEnds, bounds):
+      # Along the polyline between the tile's ends : the extremes are at its points or at the ends
+      distances = numpy.linspace(tileStart, tileEnd, 200)
+      distances = numpy.concatenate((distances, cumDistances[(cumDistances >= tileStart) & (cumDistances <= tileEnd)]))
+      tilePoints = PathGeometry.interpolateAtDistance(points, cumDistances, distances)
+      numpy.testing.assert_allclose(tileBounds[0::2], tilePoints.min(axis = 0) - radius, atol = 1e-9)
+      numpy.testing.assert_allclose(tileBounds[1::2], tilePoints.max(axis = 0) + radius, atol = 1e-9)
+
+  def test_tileOverlap(self):
+    points = helicalPath(300)
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    tileStarts, tileEnds, bounds = PathGeometry.pathTiles(points, cumDistances, 1.0, 15.0, overlap = 4.0)
+    self.assertEqual(tileStarts.size, int(numpy.ceil(cumDistances[-1] / 15.0)))
+    # The whole path is covered, consecutive tiles share the overlap
+    self.assertEqual(tileStarts[0], 0.0)
+    self.assertEqual(tileEnds[-1], cumDistances[-1])
+    numpy.testing.assert_allclose(tileEnds[:-1] - tileStarts[1:], 4.0)
+    numpy.testing.assert_allclose(tileEnds[:-2] - tileStarts[:-2], numpy.where(tileStarts[:-2] > 0.0, 19.0, 17.0))
+
+  def test_tilesOfShortPaths(self):
+    tileStarts, tileEnds, bounds = PathGeometry.pathTiles(numpy.zeros((0, 3)), numpy.zeros(0), 1.0, 10.0)
+    self.assertEqual((tileStarts.size, tileEnds.size, bounds.shape), (0, 0, (0, 6)))
+    tileStarts, tileEnds, bounds = PathGeometry.pathTiles(numpy.array([[1.0, 2.0, 3.0]]), numpy.zeros(1), 1.0, 10.0)
+    numpy.testing.assert_array_equal(tileStarts, [0.0])
+    numpy.testing.assert_array_equal(tileEnds, [0.0])
+    numpy.testing.assert_allclose(bounds, [[0.0, 2.0, 1.0, 3.0, 2.0, 4.0]])
+
+# Catmull-Rom curve through control points, samplesPerSegment curve points per segment.
+# Like the markups curves, a control point moves only the curve points of the 4 segments around it.
+# Returns the curve points and the curve point index of each control point.
+def catmullRomCurve(controlPoints, samplesPerSegment = 5):
+  padded = numpy.concatenate((controlPoints[:1], controlPoints, controlPoints[-1:]))
+  t = numpy.arange(samplesPerSegment)[:, numpy.newaxis] / samplesPerSegment
+  segments = []
+  for i in range(controlPoints.shape[0] - 1):
+    p0, p1, p2, p3 = padded[i:i + 4]
+    segments.append(0.5 * (2.0 * p1 + (p2 - p0) * t + (2.0 * p0 - 5.0 * p1 + 4.0 * p2 - p3) * t ** 2
+      + (3.0 * p1 - p0 - 3.0 * p2 + p3) * t ** 3))
+  segments.append(controlPoints[-1:])
+  return numpy.concatenate(segments), numpy.arange(controlPoints.shape[0]) * samplesPerSegment
+
+# Curve whose points are weighted averages of all control points : an edit fades out slowly along the curve
+def smoothedCurve(controlPoints, samplesPerSegment = 5):
+  parameters = numpy.arange((controlPoints.shape[0] - 1) * samplesPerSegment + 1) / samplesPerSegment
+  weights = numpy.exp(-numpy.abs(parameters[:, numpy.newaxis] - numpy.arange(controlPoints.shape[0])) / 0.7)
+  weights /= weights.sum(axis = 1)[:, numpy.newaxis]
+  return weights @ controlPoints, numpy.arange(controlPoints.shape[0]) * samplesPerSegment
+
+class PathGeometrySpliceTest(unittest.TestCase):
+
+  def setUp(self):
+    generator = numpy.random.default_rng(1)
+    self.controlPoints = numpy.cumsum(generator.normal(scale = 10.0, size = (12, 3)), axis = 0)
+    self.newPoint = generator.normal(scale = 10.0, size = 3)
+
+  # Control points after each edit at the start, in the middle and at the end of the path
+  def editedControlPoints(self):
+    edits = []
+    for index in (0, 5, 11):
+      moved = self.controlPoints.copy()
+      moved[index] += self.newPoint
+      edits.append(("move %d" % index, moved))
+      edits.append(("insert %d" % index, numpy.insert(self.controlPoints, index, self.controlPoints[index] + self.newPoint, axis = 0)))
+      edits.append(("remove %d" % index, numpy.delete(self.controlPoints, index, axis = 0)))
+    edits.append(("append", numpy.concatenate((self.controlPoints, self.controlPoints[-1:] + self.newPoint))))
+    return edits
+
+  # Splice the edit into the old path arrays, as the logic does
+  def splice(self, curve, oldControlPoints, newControlPoints, tolerance):
+    oldCurve, oldCurveIndices = curve(oldControlPoints)
+    newCurve, newCurveIndices = curve(newControlPoints)
+    points = oldCurve.copy()
+    cumDistances = PathGeometry.cumulativeDistances(points)
+    normals, axes = PathGeometry.computeFrames(points)
+    bounds = PathGeometry.pathBounds(points)
+    start, oldEnd, newEnd = PathGeometry.changedRange(oldControlPoints, newControlPoints)
+    spliceRange = PathGeometry.curveSpliceRange(points, newCurve, oldCurveIndices, newCurveIndices, start, newEnd, tolerance)
+    self.assertIsNotNone(spliceRange)
+    curveStart, oldStop, newStop = spliceRange
+    return newCurve, PathGeometry.splicePath(points, cumDistances, normals, axes, bounds,
+      curveStart, oldStop, newCurve[curveStart:newStop])
+
+  def assertMatchesFullComputation(self, name, newCurve, spliced, atol):
+    points, cumDistances, normals, axes, bounds = spliced
+    expectedNormals, expectedAxes = PathGeometry.computeFrames(newCurve)
+    numpy.testing.assert_allclose(points, newCurve, atol = atol, err_msg = name)
+    numpy.testing.assert_allclose(cumDistances, PathGeometry.cumulativeDistances(newCurve), atol = atol, err_msg = name)
+    numpy.testing.assert_allclose(normals, expectedNormals, atol = atol, err_msg = name)
+    numpy.testing.assert_allclose(axes, expectedAxes, atol = atol, err_msg = name)
+    numpy.testing.assert_allclose(bounds, PathGeometry.pathBounds(newCurve), atol = atol, err_msg = name)
+
+  def test_changedRange(self):
+    controlPoints = self.controlPoints
+    self.assertEqual(PathGeometry.changedRange(controlPoints, controlPoints.copy())[0], None)
+    moved = controlPoints.copy()
+    moved[5] += 1.0
+    self.assertEqual(PathGeometry.changedRange(controlPoints, moved), (5, 6, 6))
+    self.assertEqual(PathGeometry.changedRange(controlPoints, numpy.insert(controlPoints, 0, moved[5], axis = 0)), (0, 0, 1))
+    self.assertEqual(PathGeometry.changedRange(controlPoints, numpy.delete(controlPoints, 11, axis = 0)), (11, 12, 11))
+    # A repeated point : the tail does not overlap the unchanged head
+    repeated = numpy.concatenate((controlPoints[:3], controlPoints[2:3], controlPoints[3:]))
+    start, oldEnd, newEnd = PathGeometry.changedRange(controlPoints, repeated)
+    self.assertEqual(newEnd - start - (oldEnd - start), 1)
+    self.assertTrue(start <= oldEnd)
+
+  def test_spliceLocalCurveEdits(self):
+    for name, newControlPoints in self.editedControlPoints():
+      newCurve, spliced = self.splice(catmullRomCurve, self.controlPoints, newControlPoints, 0.0)
+      self.assertMatchesFullComputation(name, newCurve, spliced, 1e-9)
+
+  # The splice range grows until the curve is unchanged within tolerance on both sides
+  def test_spliceFadingCurveEdits(self):
+    tolerance = 1e-3
+    for name, newControlPoints in self.editedControlPoints():
+      newCurve, spliced = self.splice(smoothedCurve, self.controlPoints, newControlPoints, tolerance)
+      numpy.testing.assert_allclose(spliced[0], newCurve, atol = tolerance, err_msg = name)
+      self.assertMatchesFullComputation(name, newCurve, spliced, 0.05)
+
+  def test_spliceOfMismatchedCurves(self):
+    oldCurve, oldCurveIndices = catmullRomCurve(self.controlPoints)
+    newCurve, newCurveIndices = catmullRomCurve(self.controlPoints, samplesPerSegment = 6)
+    moved = self.controlPoints.copy()
+    moved[5] += 1.0
+    start, oldEnd, newEnd = PathGeometry.changedRange(self.controlPoints, moved)
+    self.assertIsNone(PathGeometry.curveSpliceRange(oldCurve, newCurve, oldCurveIndices, newCurveIndices, start, newEnd))
+
+# Two centerlines from the same inlet, sharing their first 10 mm, as VMTK writes them : one polyline per outlet
+# Volume whose values are a linear function of RAS coordinates, which trilinear interpolation reproduces.
+# Voxels are [k, j, i], with a spacing of (0.5, 1, 2) mm and an origin at (-5, 10, 3).
+def linearVolume():
+  ijkToRAS = numpy.diag([0.5, 1.0, 2.0, 1.0])
+  ijkToRAS[:3, 3] = [-5.0, 10.0, 3.0]
+  k, j, i = numpy.meshgrid(numpy.arange(12), numpy.arange(20), numpy.arange(30), indexing = "ij")
+  ras = numpy.stack((i, j, k), axis = -1) @ ijkToRAS[:3, :3].T + ijkToRAS[:3, 3]
+  voxels = linearFunction(ras).astype(numpy.float32)
+  return voxels, numpy.linalg.inv(ijkToRAS)
+
+def linearFunction(ras):
+  return 1.0 + 2.0 * ras[..., 0] - 3.0 * ras[..., 1] + 0.5 * ras[..., 2]
+
+class VolumeSamplingTest(unittest.TestCase):
+
+  def setUp(self):
+    self.voxels, self.rasToIJK = linearVolume()
+    ijkToRAS = numpy.linalg.inv(self.rasToIJK)
+    # RAS bounds of the voxel centers
+    self.low = ijkToRAS[:3, 3]
+    self.high = VolumeSampling.transformPoints(ijkToRAS, numpy.array(self.voxels.shape[::-1]) - 1.0)
+
+  def test_sampleLinearVolume(self):
+    generator = numpy.random.default_rng(0)
+    points = self.low + generator.random((1000, 3)) * (self.high - self.low)
+    # Voxel centers and the upper faces of the volume are inside
+    points = numpy.concatenate((points, [self.low, self.high, [self.high[0], self.low[1], self.high[2]]]))
+    numpy.testing.assert_allclose(VolumeSampling.sampleVolume(self.voxels, self.rasToIJK, points), linearFunction(points), atol = 1e-4)
+
+  def test_sampleOutsideVolume(self):
+    points = numpy.array([self.low - [0.1, 0.0, 0.0], self.high + [0.0, 0.0, 0.1], [1000.0, 0.0, 0.0]])
+    numpy.testing.assert_array_equal(VolumeSampling.sampleVolume(self.voxels, self.rasToIJK, points, outsideValue = -7.0), -7.0)
+    # Shape of the points is kept
+    grid = numpy.tile(self.low, (2, 4, 1))
+    self.assertEqual(VolumeSampling.sampleVolume(self.voxels, self.rasToIJK, grid).shape, (2, 4))
+
+  def test_diskMaskRadius(self):
+    for radius, pixelSpacing in ((5.0, 1.0), (3.0, 0.25), (2.2, 0.7)):
+      mask = VolumeSampling.diskMask(radius, pixelSpacing)
+      size = VolumeSampling.gridSize(2.0 * radius, pixelSpacing)
+      self.assertEqual(mask.shape, (size, size))
+      offsets = VolumeSampling.diskOffsets(radius, pixelSpacing)
+      self.assertEqual(offsets.shape, (numpy.count_nonzero(mask), 2))
+      self.assertTrue(numpy.all(numpy.linalg.norm(offsets, axis = 1) <= radius))
+      # The outermost pixel of the grid's middle row is within half a pixel of the circle
+      self.assertLessEqual(radius - numpy.abs(offsets[:, 0]).max(), pixelSpacing)
+      self.assertAlmostEqual(mask.sum() * pixelSpacing * pixelSpacing / (numpy.pi * radius * radius), 1.0, delta = 0.15)
+    # A radius smaller than a pixel keeps the center
+    numpy.testing.assert_array_equal(VolumeSampling.diskOffsets(0.1, 1.0), [[0.0, 0.0]])
+
+  def test_volumeTiles(self):
+    middle = (self.low + self.high) / 2.0
+    tileBounds = numpy.array([
+      [middle[0] - 1.0, middle[0] + 1.0, middle[1] - 2.0, middle[1] + 2.0, middle[2] - 2.0, middle[2] + 2.0],
+      # Entirely outside
+      [100.0, 110.0, 0.0, 1.0, 0.0, 1.0],
+      # Partly outside, below the lowest voxels
+      [self.low[0] - 10.0, self.low[0] + 1.0, middle[1], middle[1] + 1.0, self.low[2] - 10.0, self.low[2] + 1.0],
+      ])
+    tiles = list(VolumeSampling.volumeTiles(self.voxels, self.rasToIJK, tileBounds))
+    self.assertEqual([tile for tile, slices, view in tiles], [0, 2])
+    ijk = numpy.stack(numpy.meshgrid(*[numpy.arange(size) for size in self.voxels.shape[::-1]], indexing = "ij"), axis = -1).reshape(-1, 3)
+    ras = VolumeSampling.transformPoints(numpy.linalg.inv(self.rasToIJK), ijk)
+    for tile, slices, view in tiles:
+      # Views, not copies
+      self.assertTrue(numpy.shares_memory(view, self.voxels))
+      numpy.testing.assert_array_equal(view, self.voxels[slices])
+      # Every voxel center within the box is in the tile, and the tile is within the volume
+      inside = numpy.all((ras >= tileBounds[tile, 0::2]) & (ras <= tileBounds[tile, 1::2]), axis = 1)
+      self.assertTrue(inside.any())
+      for axis, sliceOfAxis in enumerate(slices[::-1]):
+        self.assertGreaterEqual(ijk[inside, axis].min(), sliceOfAxis.start)
+        self.assertLess(ijk[inside, axis].max(), sliceOfAxis.stop)
+        self.assertGreaterEqual(sliceOfAxis.start, 0)
+        self.assertLessEqual(sliceOfAxis.stop, self.voxels.shape[2 - axis])
+    # The part below the volume is clipped
+    self.assertEqual(tiles[1][1][0].start, 0)
+    self.assertEqual(tiles[1][1][2].start, 0)
+
+  # Frames across the volume, crossing chunk boundaries, compared with sampling each frame alone
+  def test_statisticsAcrossChunks(self):
+    numberOfFrames = 600
+    t = numpy.linspace(0.0, 1.0, numberOfFrames)[:, numpy.newaxis]
+    middle = (self.low + self.high) / 2.0
+    origins = middle + (t - 0.5) * [8.0, 10.0, 10.0]
+    normals = numpy.tile([0.0, 0.0, 1.0], (numberOfFrames, 1))
+    axes = numpy.tile([1.0, 0.0, 0.0], (numberOfFrames, 1))
+    radius, pixelSpacing, threshold = 2.0, 0.5, linearFunction(middle)
+    statistics = VolumeSampling.crossSectionStatistics(self.voxels, self.rasToIJK, origins, normals, axes,
+      radius, pixelSpacing, threshold)
+    offsets = VolumeSampling.diskOffsets(radius, pixelSpacing)
+    for frame in (0, 255, 256, 257, 511, 512, numberOfFrames - 1):
+      points = origins[frame] + offsets[:, 0:1] * axes[frame] + offsets[:, 1:2] * numpy.cross(normals[frame], axes[frame])
+      values = VolumeSampling.sampleVolume(self.voxels, self.rasToIJK, points)
+      expected = (values.mean(), values.max(), values.min(), numpy.count_nonzero(values >= threshold) * pixelSpacing * pixelSpacing)
+      numpy.testing.assert_allclose([values[frame] for values in statistics], expected, rtol = 1e-9, err_msg = str(frame))
+    # The disk is symmetric : on a linear volume, the mean is the value at the center
+    numpy.testing.assert_allclose(statistics[0], linearFunction(origins), atol = 1e-4)
+    for framesPerChunk in (1, 7, numberOfFrames):
+      chunked = VolumeSampling.crossSectionStatistics(self.voxels, self.rasToIJK, origins, normals, axes,
+        radius, pixelSpacing, threshold, framesPerChunk)
+      for values, chunkedValues in zip(statistics, chunked):
+        numpy.testing.assert_array_equal(values, chunkedValues)
+
+class CrossSectionCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    # Room for 3 images of 100 bytes
+    self.cache = CrossSectionCache.CrossSectionImageCache(memoryBudget = 300)
+
+  def tearDown(self):
+    self.cache.stop()
+
+  def image(self, value, size = 100):
+    return numpy.full(size, value, dtype = numpy.uint8)
+
+  def test_leastRecentlyUsedImagesAreEvicted(self):
+    for key in "abc":
+      self.cache.put(key, self.image(ord(key)))
+    # A lookup makes 'a' the most recently used : 'b' goes first
+    self.assertIsNotNone(self.cache.get("a"))
+    self.cache.put("d", self.image(0))
+    self.assertEqual(list(self.cache.images), ["c", "a", "d"])
+    self.cache.put("e", self.image(0))
+    self.assertEqual(list(self.cache.images), ["a", "d", "e"])
+
+  def test_memoryAccounting(self):
+    self.cache.put("a", self.image(1))
+    self.cache.put("b", self.image(2, 150))
+    self.assertEqual(self.cache.statistics()["memoryUsed"], 250)
+    # Replacing an image accounts for its new size only
+    self.cache.put("b", self.image(2, 50))
+    self.assertEqual(self.cache.statistics()["memoryUsed"], 150)
+    # An image larger than the budget is not kept, and neither is the one it replaces
+    self.cache.put("a", self.image(1, 400))
+    self.assertEqual(list(self.cache.images), ["b"])
+    self.assertEqual(self.cache.statistics()["memoryUsed"], 50)
+    self.cache.put("c", self.image(3, 260))
+    self.assertEqual(list(self.cache.images), ["c"])
+    self.assertEqual(self.cache.statistics()["memoryUsed"], 260)
+    self.assertFalse(self.cache.images["c"].flags.writeable)
+    self.cache.clear()
+    self.assertEqual(self.cache.statistics()["memoryUsed"], 0)
+    self.assertEqual(len(self.cache.images), 0)
+
+  def test_hitsAndMisses(self):
+    computed = []
+    compute = lambda: computed.append(1) or self.image(1)
+    self.assertIsNone(self.cache.get("a"))
+    self.cache.getOrCompute("a", compute)
+    self.cache.getOrCompute("a", compute)
+    self.assertEqual(len(computed), 1)
+    statistics = self.cache.statistics()
+    self.assertEqual((statistics["hits"], statistics["misses"]), (1, 2))
+
+  def test_prefetchFillsCache(self):
+    computed = threading.Event()
+    def compute(value):
+      def computeImage():
+        if value == 3:
+          computed.set()
+        return self.image(value)
+      return computeImage
+    # 'a' is cached already and not computed again
+    self.cache.memoryBudget = 1000
+    self.cache.put("a", self.image(0))
+    self.cache.prefetch([(key, compute(value)) for value, key in enumerate("abcd")])
+    self.assertTrue(computed.wait(5.0))
+    thread = self.cache.prefetchThread
+    self.cache.stop()
+    self.assertFalse(thread.is_alive())
+    self.assertIsNone(self.cache.prefetchThread)
+    self.assertEqual(sorted(self.cache.images), ["a", "b", "c", "d"])
+    self.assertEqual(self.cache.images["a"][0], 0)
+
+  def test_cancelPrefetch(self):
+    started = threading.Event()
+    release = threading.Event()
+    def blocking():
+      started.set()
+      release.wait(5.0)
+      return self.image(1)
+    self.cache.prefetch([("a", blocking), ("b", lambda: self.image(2))])
+    self.assertTrue(started.wait(5.0))
+    self.cache.cancelPrefetch()
+    release.set()
+    self.cache.stop()
+    # The image being computed is kept, the pending one is dropped
+    self.assertEqual(list(self.cache.images), ["a"])
+
+def bifurcationCenterlines():
+  trunk = numpy.stack((numpy.zeros(11), numpy.zeros(11), numpy.arange(11.0)), axis = 1)
+  firstBranch = numpy.stack((numpy.linspace(0.0, 5.0, 6)[1:], numpy.zeros(5), numpy.linspace(10.0, 15.0, 6)[1:]), axis = 1)
+  secondBranch = numpy.stack((numpy.linspace(0.0, -5.0, 11)[1:], numpy.zeros(10), numpy.linspace(10.0, 20.0, 11)[1:]), axis = 1)
+  firstCenterline = numpy.concatenate((trunk, firstBranch))
+  secondCenterline = numpy.concatenate((trunk, secondBranch))
+  points = numpy.concatenate((firstCenterline, secondCenterline))
+  cells = [numpy.arange(firstCenterline.shape[0]), firstCenterline.shape[0] + numpy.arange(secondCenterline.shape[0])]
+  return points, cells
+
+class BranchGraphTest(unittest.TestCase):
+
+  def test_importedAsModule(self):
+    self.assertTrue(inspect.ismodule(BranchGraph))
+    self.assertTrue(inspect.isclass(BranchGraph.BranchGraph))
+
+  def test_cellsFromLegacyArray(self):
+    cells = BranchGraph.cellsFromLegacyArray([3, 0, 1, 2, 2, 5, 6])
+    self.assertEqual([list(cell) for cell in cells], [[0, 1, 2], [5, 6]])
+
+  def test_bifurcation(self):
+    points, cells = bifurcationCenterlines()
+    graph = BranchGraph.BranchGraph(points, cells)
+    self.assertEqual(graph.numberOfBranches, 3)
+    numpy.testing.assert_allclose(sorted(graph.branchLengths), sorted([10.0, numpy.sqrt(50.0), numpy.sqrt(125.0)]))
+    endNodes = graph.endNodes()
+    self.assertEqual(len(endNodes), 2)
+    for endNode in endNodes:
+      pointIds = graph.routePointIds(endNode)
+      routePoints = points[pointIds]
+      # From the inlet, without repeated junction points, and as long as the route
+      numpy.testing.assert_allclose(routePoints[0], [0.0, 0.0, 0.0])
+      self.assertTrue(numpy.all(PathGeometry.segmentLengths(routePoints) > 0.0))
+      self.assertAlmostEqual(PathGeometry.cumulativeDistances(routePoints)[-1], graph.routeLength(endNode))
+    self.assertEqual(sorted(graph.routePointIds(endNode).size for endNode in endNodes), [16, 21])
+
+  def test_singleCenterline(self):
+    points = numpy.stack((numpy.zeros(11), numpy.zeros(11), numpy.arange(11.0)), axis = 1)
+    graph = BranchGraph.BranchGraph(points, [numpy.arange(11)])
+    self.assertEqual(graph.numberOfBranches, 1)
+    numpy.testing.assert_array_equal(graph.branchPointIds[0], numpy.arange(11))
+    numpy.testing.assert_array_equal(graph.routePointIds(graph.endNodes()[0]), numpy.arange(11))
+
+  def test_closedLoop(self):
+    t = numpy.linspace(0.0, 2.0 * numpy.pi, 20, endpoint = False)
+    points = numpy.stack((numpy.cos(t), numpy.sin(t), numpy.zeros(20)), axis = 1)
+    graph = BranchGraph.BranchGraph(points, [numpy.append(numpy.arange(20), 0)])
+    self.assertEqual(graph.numberOfBranches, 1)
+    self.assertEqual(len(graph.branchPointIds[0]), 21)
+
+class PathBatchRouteTest(unittest.TestCase):
+
+  def test_modelRoutesOfBifurcation(self):
+    points, cells = bifurcationCenterlines()
+    radii = numpy.arange(points.shape[0], dtype = numpy.float64)
+    routes = PathBatch.modelRoutes(points, radii, cells)
+    self.assertEqual(len(routes), 2)
+    # One path per centerline, not the points of both centerlines
+    lengths = sorted(PathGeometry.cumulativeDistances(routePoints)[-1] for routePoints, routeRadii in routes)
+    numpy.testing.assert_allclose(lengths, [10.0 + numpy.sqrt(50.0), 10.0 + numpy.sqrt(125.0)])
+    for routePoints, routeRadii in routes:
+      self.assertEqual(routeRadii.shape[0], routePoints.shape[0])
+      numpy.testing.assert_array_equal(points[routeRadii.astype(numpy.int64)], routePoints)
+
+  def test_modelRoutesOfSingleCenterline(self):
+    points = numpy.stack((numpy.zeros(11), numpy.zeros(11), numpy.arange(11.0)), axis = 1)
+    routes = PathBatch.modelRoutes(points, None, [numpy.arange(11)])
+    self.assertEqual(len(routes), 1)
+    numpy.testing.assert_array_equal(routes[0][0], points)
+    self.assertIsNone(routes[0][1])
+
+  def test_modelRoutesWithoutLines(self):
+    points = helicalPath(20)
+    routes = PathBatch.modelRoutes(points, None, [])
+    self.assertEqual(len(routes), 1)
+    numpy.testing.assert_array_equal(routes[0][0], points)
+
+class PathBatchTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors = True)
+
+  def test_profileWithoutVolume(self):
+    points = helicalPath(100)
+    radii = numpy.linspace(1.0, 2.0, 100)
+    profile = PathBatch.computePathProfile(points, radii)
+    numpy.testing.assert_allclose(profile["distance"], PathGeometry.cumulativeDistances(points))
+    normals, axes = PathGeometry.computeFrames(points)
+    numpy.testing.assert_allclose(profile["normals"], normals)
+    numpy.testing.assert_allclose(profile["axes"], axes)
+    numpy.testing.assert_array_equal(profile["radius"], radii)
+    self.assertNotIn("mean", profile)
+    with self.assertRaises(ValueError):
+      PathBatch.computePathProfile(points[:1])
+
+  # Straight path across a linear volume : positions at each mm, and the mean of each disk is the value at its center
+  def test_profileWithVolume(self):
+    voxels, rasToIJK = linearVolume()
+    points = numpy.stack((numpy.linspace(-2.0, 6.0, 17), numpy.full(17, 20.0), numpy.full(17, 14.0)), axis = 1)
+    radii = numpy.linspace(1.0, 3.0, 17)
+    threshold = linearFunction(points[8])
+    profile = PathBatch.computePathProfile(points, radii, volume = (voxels, rasToIJK), statisticsParameters = (1.0, 2.0, threshold))
+    numpy.testing.assert_allclose(profile["distance"], numpy.arange(9.0))
+    numpy.testing.assert_allclose(profile["points"][:, 0], numpy.arange(-2.0, 7.0))
+    numpy.testing.assert_allclose(profile["normals"], numpy.tile([1.0, 0.0, 0.0], (9, 1)), atol = 1e-12)
+    numpy.testing.assert_allclose(profile["mean"], linearFunction(profile["points"]), atol = 1e-4)
+    numpy.testing.assert_allclose(profile["radius"], numpy.linspace(1.0, 3.0, 9))
+    # Values grow along x : the lumen grows from none to the whole disk
+    diskArea = VolumeSampling.diskOffsets(2.0, 0.5).shape[0] * 0.25
+    self.assertEqual(profile["lumenArea"][0], 0.0)
+    self.assertEqual(profile["lumenArea"][-1], diskArea)
+    self.assertTrue(numpy.all(numpy.diff(profile["lumenArea"]) >= 0.0))
+
+  def test_writeProfile(self):
+    points = helicalPath(20)
+    profile = PathBatch.computePathProfile(points, numpy.full(20, 1.5))
+    fileName = os.path.join(self.directory, "profile.csv")
+    PathBatch.writeProfile(fileName, profile)
+    with open(fileName, newline = "") as profileFile:
+      rows = list(csv.reader(profileFile))
+    self.assertEqual(rows[0], ["Distance", "R", "A", "S", "NormalR", "NormalA", "NormalS", "Radius"])
+    values = numpy.array(rows[1:], dtype = numpy.float64)
+    self.assertEqual(values.shape, (20, 8))
+    numpy.testing.assert_allclose(values[:, 0], profile["distance"])
+    numpy.testing.assert_allclose(values[:, 1:4], points)
+    numpy.testing.assert_allclose(values[:, 4:7], profile["normals"])
+    numpy.testing.assert_allclose(values[:, 7], 1.5)
+
+  def writeMarkups(self, name, coordinateSystem, positions):
+    markups = {"type" : "Curve", "controlPoints" : [{"position" : position} for position in positions]}
+    if coordinateSystem is not None:
+      markups["coordinateSystem"] = coordinateSystem
+    fileName = os.path.join(self.directory, name)
+    with open(fileName, "w") as markupsFile:
+      json.dump({"markups" : [markups]}, markupsFile)
+    return fileName
+
+  # Without Slicer, control points are read as they are, and LPS coordinates are converted to RAS
+  def test_readMarkupsFile(self):
+    positions = [[1.0, 2.0, 3.0], [4.0, -5.0, 6.0]]
+    for coordinateSystem, expected in (("LPS", [[-1.0, -2.0, 3.0], [-4.0, 5.0, 6.0]]),
+        (None, [[-1.0, -2.0, 3.0], [-4.0, 5.0, 6.0]]), ("RAS", positions)):
+      points, radii = PathBatch.readPathFile(self.writeMarkups("curve.mrk.json", coordinateSystem, positions))
+      numpy.testing.assert_array_equal(points, expected)
+      self.assertIsNone(radii)
+
+  def test_pathFilesOfDirectory(self):
+    numpy.save(os.path.join(self.directory, "path.npy"), helicalPath(10))
+    self.writeMarkups("curve.mrk.json", "LPS", [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
+    with open(os.path.join(self.directory, "settings.json"), "w") as settingsFile:
+      settingsFile.write("{}")
+    names = [os.path.basename(pathFile) for pathFile in PathBatch._collectPathFiles([self.directory])]
+    self.assertEqual(names, ["curve.mrk.json", "path.npy"])
+
+  def test_outputNamesAreUnique(self):
+    pathFiles = [os.path.join("data", "left", "vessel.vtp"), os.path.join("data", "right", "Vessel.vtp"),
+      os.path.join("data", "right", "curve.mrk.json"), os.path.join("data", "left", "vessel.vtp")]
+    self.assertEqual(PathBatch._outputNames(pathFiles), ["left_vessel", "right_Vessel", "curve", "left_vessel_2"])
+
+class PathDataCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache = PathDataCache.PathDataCache(self.directory)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors = True)
+
+  # The package must not replace the submodule by its class of the same name
+  def test_importedAsModule(self):
+    import CrossSectionAnalysisLib
+    self.assertTrue(inspect.ismodule(CrossSectionAnalysisLib.PathDataCache))
+    self.assertTrue(inspect.isclass(PathDataCache.PathDataCache))
+    self.assertIsInstance(self.cache, PathDataCache.PathDataCache)
+
+  def test_keyDependsOnPointsAndParameters(self):
+    points = helicalPath(50)
+    key = self.cache.key(points, {"step" : 0.1})
+    self.assertEqual(key, self.cache.key(points.copy(), {"step" : 0.1}))
+    self.assertNotEqual(key, self.cache.key(points, {"step" : 0.2}))
+    movedPoints = points.copy()
+    movedPoints[10, 0] += 1e-6
+    self.assertNotEqual(key, self.cache.key(movedPoints, {"step" : 0.1}))
+
+  def test_saveAndLoad(self):
+    key = self.cache.key(helicalPath(50))
+    self.assertIsNone(self.cache.load(key))
+    arrays = {"normals" : numpy.ones((50, 3)), "distances" : numpy.arange(50.0)}
+    self.cache.save(key, arrays)
+    loaded = self.cache.load(key)
+    self.assertEqual(sorted(loaded), sorted(arrays))
+    for name in arrays:
+      numpy.testing.assert_array_equal(loaded[name], arrays[name])
+
+  def test_leastRecentlyUsedFilesAreEvicted(self):
+    keys = [self.cache.key(helicalPath(50 + index)) for index in range(4)]
+    for index, key in enumerate(keys):
+      self.cache.save(key, {"values" : numpy.zeros(2000)})
+      os.utime(self.cache.fileName(key), (index, index))
+    fileSize = os.path.getsize(self.cache.fileName(keys[0]))
+    # Loading the oldest file marks it as used
+    self.assertIsNotNone(self.cache.load(keys[0]))
+    self.cache.maximumSize = 2 * fileSize
+    self.cache.evict()
+    self.assertEqual([os.path.isfile(self.cache.fileName(key)) for key in keys], [True, False, False, True])
+    self.cache.clear()
+    self.assertEqual(os.listdir(self.directory), [])
+
+class InstrumentationTest(unittest.TestCase):
+
+  def setUp(self):
+    Instrumentation.reset()
+    Instrumentation.setEnabled(True)
+
+  def tearDown(self):
+    Instrumentation.setEnabled(False)
+    Instrumentation.reset()
+
+  # PythonQt passes a slot as many signal arguments as its code declares
+  def test_wrapperKeepsArgumentCount(self):
+    class Handlers(object):
+      @Instrumentation.instrumented()
+      def onClicked(self):
+        return "clicked"
+      @Instrumentation.instrumented()
+      def onValueChanged(self, value, scale = 2):
+        return value * scale
+    for function, argumentCount in ((Handlers.onClicked, 1), (Handlers.onValueChanged, 3)):
+      self.assertEqual(function.__code__.co_argcount, argumentCount)
+      self.assertFalse(function.__code__.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS))
+    handlers = Handlers()
+    self.assertEqual(handlers.onClicked(), "clicked")
+    self.assertEqual(handlers.onValueChanged(3), 6)
+    self.assertEqual(handlers.onValueChanged(3, scale = 3), 9)
+    self.assertEqual(Handlers.onValueChanged.__name__, "onValueChanged")
+
+  def test_callsAreCounted(self):
+    @Instrumentation.instrumented("counted")
+    def counted(value):
+      return value
+    for value in range(5):
+      counted(value)
+    Instrumentation.setEnabled(False)
+    counted(5)
+    statistics = Instrumentation.statistics()["counted"]
+    self.assertEqual(statistics["count"], 5)
+    self.assertEqual(sum(statistics["histogram"].values()), 5)
+
+  def test_variableArgumentsAreForwarded(self):
+    @Instrumentation.instrumented()
+    def forwarded(*args, **kwargs):
+      return args, kwargs
+    self.assertEqual(forwarded(1, 2, key = 3), ((1, 2), {"key" : 3}))
+
+if __name__ == "__main__":
+  unittest.main()